@@ -1,14 +1,346 @@
 import inspect
+import hashlib
+import json
 import os
 import sys
 from numpy             import *
 from scipy.io          import loadmat, netcdf_file
-from scipy.interpolate import griddata
+from scipy.sparse      import coo_matrix, csr_matrix
+from scipy.spatial     import Delaunay
+from matplotlib.tri    import Triangulation
 from osgeo             import gdal
 from pyproj            import Proj, transform
+from functools         import wraps
+from multiprocessing.pool import ThreadPool
+
+
+def store_directory(get, args, kwargs):
+  """
+  Return the directory of the raster store holding the data returned by 
+  DataFactory method <get> called with arguments <args> and <kwargs>.
+  """
+  filename = inspect.getframeinfo(inspect.currentframe()).filename
+  home     = os.path.dirname(os.path.abspath(filename))
+  callargs = inspect.getcallargs(get, *args, **kwargs)
+  name     = get.__name__
+  for k in sorted(callargs.keys()):
+    name += '_%s=%r' % (k, callargs[k])
+  return home + '/store/' + name + '/'
+
+
+def stored(get):
+  """
+  Decorator for the DataFactory get_* methods.  If DataFactory.convert() has
+  written the data for the same arguments to the raster store, it is 
+  returned as memory-mapped arrays, without reading the source files.
+  """
+  @wraps(get)
+  def get_stored(*args, **kwargs):
+    direc = store_directory(get, args, kwargs)
+    if os.path.isfile(direc + 'meta.json'):
+      return DataFactory.read_store(direc)
+    return get(*args, **kwargs)
+  get_stored.source = get
+  return get_stored
+
+
+def read_layers(readers):
+  """
+  Return a dictionary of the arrays returned by the functions in the 
+  dictionary <readers>, called concurrently by a pool of at most 
+  DataFactory.threads threads.  The decompression and byte-swapping of the
+  layers are done by zlib and numpy with the GIL released.
+  """
+  names = readers.keys()
+  if DataFactory.threads <= 1 or len(names) < 2:
+    return dict((n, readers[n]()) for n in names)
+  pool = ThreadPool(min(DataFactory.threads, len(names)))
+  try:
+    layers = pool.map(lambda n: readers[n](), names)
+  finally:
+    pool.close()
+    pool.join()
+  return dict(zip(names, layers))
+
+
+def read_tiff(filename, rows=None, cols=None):
+  """
+  Return the array of the TIFF file <filename>, or only the rows and columns
+  given by the slices <rows> and <cols>, in which case only the parts of 
+  the file overlapping them are read.
+  """
+  from tifffile import TiffFile
+  with TiffFile(filename) as f:
+    if rows == None:
+      return f.asarray()
+    return f.pages[0].asarray_window((rows.start, rows.stop),
+                                     (cols.start, cols.stop))
+
+
+def grid_window(bbox, west, east, south, north, nx, ny, flip=False):
+  """
+  Return the slices of the rows and columns of the grid of <nx> by <ny> 
+  points spanning <west> to <east> and <south> to <north> which cover the 
+  map coordinate bounding box <bbox> = (x_min, y_min, x_max, y_max), and 
+  the (west, east, south, north) edges of that subgrid, such that the 
+  points of the subgrid are those of the grid.  If <flip> is True, the rows
+  of the grid are stored from north to south.  If <bbox> is None, the 
+  window is the whole grid.
+  """
+  if bbox == None:
+    return slice(0, ny), slice(0, nx), (west, east, south, north)
+  
+  x  = linspace(west,  east,  nx)
+  y  = linspace(south, north, ny)
+  i0 = max(searchsorted(x, bbox[0], 'right') - 1, 0)
+  i1 = min(searchsorted(x, bbox[2]) + 1, nx)
+  j0 = max(searchsorted(y, bbox[1], 'right') - 1, 0)
+  j1 = min(searchsorted(y, bbox[3]) + 1, ny)
+  if i1 <= i0 or j1 <= j0:
+    raise ValueError('bounding box %s does not overlap the data' % str(bbox))
+  
+  edges = (x[i0], x[i1-1], y[j0], y[j1-1])
+  if flip:
+    return slice(ny - j1, ny - j0), slice(i0, i1), edges
+  return slice(j0, j1), slice(i0, i1), edges
+
+
+def select_fields(fields, needs):
+  """
+  Return the list of the fields of a dataset to create, <fields>, or all of
+  them if <fields> is None, and the set of the layers which must be read to
+  create them, where <needs> is a dictionary of the layers each field is 
+  made from.
+  """
+  if fields == None:
+    fields = needs.keys()
+  layers = set()
+  for n in fields:
+    if n not in needs:
+      raise KeyError('unknown field %s' % n)
+    layers.update(needs[n])
+  return list(fields), layers
+
+
+def cast(f, dtype, copy=True):
+  """
+  Return a copy of the array <f> with type <dtype>, or its own type if 
+  <dtype> is None.  If <copy> is False, <f> itself is returned if it has
+  that type already.
+  """
+  if not copy:
+    return asarray(f, dtype=dtype)
+  return array(f, dtype=dtype)
+
+
+def as_mask(f):
+  """
+  Return the mask or coverage array <f> in the smallest integer type that
+  holds its values exactly: unsigned bytes, or 16-bit integers for masks 
+  with negative no-data values such as bedmap2's -9999.  Arrays with NaNs 
+  or fractional values are returned unchanged, so that no-data is never 
+  mistaken for one of the classes of the mask.
+  """
+  f = asarray(f)
+  if f.size == 0:
+    return f.astype(uint8)
+  if f.dtype.kind == 'f' and (f != floor(f)).any():
+    return f
+  lo, hi = f.min(), f.max()
+  for t in (uint8, int16):
+    if lo >= iinfo(t).min and hi <= iinfo(t).max:
+      return f.astype(t)
+  return f
+
+
+def digest(*arrays):
+  """
+  Return the SHA-1 hex digest of the contents of the arrays <arrays>.
+  """
+  h = hashlib.sha1()
+  for a in arrays:
+    h.update(ascontiguousarray(a).tostring())
+  return h.hexdigest()
+
+
+def scattered_directory():
+  """
+  Return the directory of the cached triangulations and interpolation 
+  matrices of the scattered datasets.
+  """
+  filename = inspect.getframeinfo(inspect.currentframe()).filename
+  home     = os.path.dirname(os.path.abspath(filename))
+  direc    = home + '/store/scattered/'
+  if not os.path.isdir(direc):
+    os.makedirs(direc)
+  return direc
+
+
+def save_cached(filename, **arrays):
+  """
+  Save the arrays <arrays> to the .npz file <filename> through a temporary
+  file, so that an interrupted write never leaves a corrupt cache file.
+  """
+  tmp = filename + '.%i.tmp.npz' % os.getpid()
+  savez(tmp, **arrays)
+  os.rename(tmp, filename)
+
+
+def triangulate(lon, lat, proj_s):
+  """
+  Return the key, the x and y coordinates in the projection <proj_s>, and 
+  the Delaunay triangles of the scattered points with longitudes <lon> and
+  latitudes <lat>.  The projection and triangulation are computed only once
+  for a point set and read from the cache afterwards.
+  """
+  key      = digest(lon, lat, frombuffer(proj_s, uint8))
+  filename = scattered_directory() + key + '_tri.npz'
+  if os.path.isfile(filename):
+    f = load(filename)
+    return key, f['x'], f['y'], f['triangles']
+  
+  print "::: triangulating %i scattered points :::" % len(lon)
+  x, y      = Proj(proj_s)(lon, lat)
+  x, y      = array(x), array(y)
+  triangles = Delaunay(c_[x, y]).simplices
+  save_cached(filename, x=x, y=y, triangles=triangles)
+  return key, x, y, triangles
+
+
+def interpolation_matrix(key, x, y, triangles, X, Y):
+  """
+  Return the sparse matrix which maps values at the scattered points <x>, 
+  <y> with triangulation <triangles> and key <key>, as returned by 
+  triangulate(), to their linear interpolation at the points <X>, <Y>.  
+  Each row holds the barycentric coordinates of a point in the triangle 
+  containing it, and is zero for points outside of the triangulation, as 
+  griddata() with fill_value=0.0.  The matrix is computed only once for a
+  point set and target points and read from the cache afterwards.
+  """
+  X        = asarray(X, dtype=float64).ravel()
+  Y        = asarray(Y, dtype=float64).ravel()
+  filename = scattered_directory() + key + '_' + digest(X, Y) + '.npz'
+  if os.path.isfile(filename):
+    f = load(filename)
+    return csr_matrix((f['data'], f['indices'], f['indptr']), 
+                      shape=tuple(f['shape']))
+  
+  print "::: computing weights for %i points :::" % len(X)
+  find   = Triangulation(x, y, triangles).get_trifinder()
+  t      = find(X, Y)
+  
+  # points on the convex hull are found by moving them slightly inwards :
+  out    = flatnonzero(t < 0)
+  eps    = 1e-9
+  t[out] = find(X[out] + eps*(x.mean() - X[out]), 
+                Y[out] + eps*(y.mean() - Y[out]))
+  inside = flatnonzero(t >= 0)
+  v      = triangles[t[inside]]
+  xv     = x[v]
+  yv     = y[v]
+  dx     = X[inside] - xv[:,2]
+  dy     = Y[inside] - yv[:,2]
+  det    = (yv[:,1] - yv[:,2])*(xv[:,0] - xv[:,2]) \
+           + (xv[:,2] - xv[:,1])*(yv[:,0] - yv[:,2])
+  l0     = ((yv[:,1] - yv[:,2])*dx + (xv[:,2] - xv[:,1])*dy) / det
+  l1     = ((yv[:,2] - yv[:,0])*dx + (xv[:,0] - xv[:,2])*dy) / det
+  w      = c_[l0, l1, 1 - l0 - l1].ravel()
+  W      = coo_matrix((w, (repeat(inside, 3), v.ravel())), 
+                      shape=(len(X), len(x))).tocsr()
+  save_cached(filename, data=W.data, indices=W.indices, indptr=W.indptr,
+              shape=array(W.shape))
+  return W
+
 
 class DataFactory(object):
  
+  # number of threads used to read the layers of a dataset, and the datasets
+  # given to get_concurrently() :
+  threads = 4
+ 
+  @staticmethod
+  def get_concurrently(calls):
+    """
+    Return the list of data returned by the DataFactory methods given by 
+    <calls>, a list of (name, kwargs) pairs, e.g., 
+    [('get_searise', {'thklim' : 200.0}), ('get_gre_rignot', {})], called
+    concurrently by a pool of at most DataFactory.threads threads.
+    """
+    readers = dict((i, lambda n=n, kw=kw: getattr(DataFactory, n)(**kw))
+                   for i, (n, kw) in enumerate(calls))
+    vara    = read_layers(readers)
+    return [vara[i] for i in range(len(calls))]
+
+
+  @staticmethod
+  def convert(name, *args, **kwargs):
+    """
+    Write the data returned by DataFactory method with name <name>, called 
+    with arguments <args> and <kwargs>, to the raster store, one .npy file 
+    per field and a 'meta.json' file with the extents and projection of 
+    each, including the digest of its data, which identifies it in the 
+    cache keys of DataInput.  Later calls of the method with the same 
+    arguments read the store instead of the source files.
+    """
+    get   = getattr(DataFactory, name).source
+    direc = store_directory(get, args, kwargs)
+    vara  = get(*args, **kwargs)
+    
+    print "::: converting %s to %s :::" % (name, direc)
+    if not os.path.isdir(direc):
+      os.makedirs(direc)
+    
+    meta = {'dataset' : vara.pop('dataset'), 'fields' : {}}
+    for n, d in vara.items():
+      save(direc + n + '.npy', ascontiguousarray(d['map_data']))
+      meta['fields'][n] = {'map_western_edge'  : float(d['map_western_edge']),
+                           'map_eastern_edge'  : float(d['map_eastern_edge']),
+                           'map_southern_edge' : float(d['map_southern_edge']),
+                           'map_northern_edge' : float(d['map_northern_edge']),
+                           'projection'        : str(d['projection']),
+                           'standard lat'      : str(d['standard lat']),
+                           'standard lon'      : str(d['standard lon']),
+                           'lat true scale'    : str(d['lat true scale']),
+                           'digest'            : digest(d['map_data'])}
+    
+    # the metadata is written last, marking the store as complete :
+    with open(direc + 'meta.json', 'w') as f:
+      json.dump(meta, f, indent=2)
+
+
+  @staticmethod
+  def convert_all():
+    """
+    Convert every dataset with the default arguments, skipping those whose 
+    source files are not present.
+    """
+    for name in sorted(dir(DataFactory)):
+      if hasattr(getattr(DataFactory, name), 'source'):
+        try:
+          DataFactory.convert(name)
+        except (IOError, OSError, RuntimeError), e:
+          print "::: could not convert %s : %s :::" % (name, e)
+
+
+  @staticmethod
+  def read_store(direc):
+    """
+    Return the dictionary of data written to the raster store directory 
+    <direc> by convert(), with the arrays memory-mapped copy-on-write, so 
+    that they are only read from disk as they are used, are shared between 
+    processes through the page cache, and may still be modified in memory.
+    """
+    with open(direc + 'meta.json', 'r') as f:
+      meta = json.load(f)
+    
+    vara = {'dataset' : str(meta['dataset'])}
+    for n, d in meta['fields'].items():
+      n       = str(n)
+      vara[n] = dict((str(k), v) for k, v in d.items())
+      vara[n]['map_data'] = load(direc + n + '.npy', mmap_mode='c')
+    return vara
+
+
   @staticmethod 
   def print_dim(rg):
   
@@ -24,7 +356,9 @@ class DataFactory(object):
   
   
   @staticmethod
-  def get_ant_measures(res = 900):
+  @stored
+  def get_ant_measures(res = 900, fields = None, dtype = None,
+                       bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
@@ -34,36 +368,44 @@ class DataFactory(object):
     else:
       direc    = home + '/antarctica/measures/antarctica_ice_velocity_450m.nc' 
 
-    data     = netcdf_file(direc, mode = 'r')
+    data     = netcdf_file(direc, mode = 'r', mmap = True)
     vara     = dict()
+    
+    # fields to create, and the layers they are made from :
+    names, layers = select_fields(fields, {'vx'    : ['vx'],
+                                           'vy'    : ['vy'],
+                                           'v_err' : ['err'],
+                                           'U_ob'  : ['vx', 'vy']})
   
-    # retrieve data :
-    vx   = array(data.variables['vx'][:])
-    vy   = array(data.variables['vy'][:])
-    err  = array(data.variables['err'][:])
-    vmag = sqrt(vx**2 + vy**2)
-     
-    # extents of domain :
-    m,n   =  shape(vx)
+    # extents of domain, and the window of it to read :
+    v     =  data.variables
+    m,n   =  v['vx'].shape
     dx    =  450
     west  = -2800000.0
     east  =  west + n*dx
     north =  2800000.0
     south =  north - m*dx
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, n, m, flip=True)
 
+    # retrieve data :
+    l    = read_layers(dict((n, lambda n=n : cast(v[n][rows, cols], dtype))
+                            for n in layers))
+    ftns = {'vx'    : lambda : l['vx'],
+            'vy'    : lambda : l['vy'],
+            'v_err' : lambda : l['err'],
+            'U_ob'  : lambda : sqrt(l['vx']**2 + l['vy']**2)}
+     
     #projection info :
     proj   = 'stere'
     lat_0  = '-90'
     lat_ts = '-71'
     lon_0  = '0'
     
-    names = ['vx', 'vy', 'v_err', 'U_ob']
-    ftns  = [vx, vy, err, vmag]
-    
     # save the data in matlab format :
     vara['dataset'] = 'measures'
-    for n, f in zip(names, ftns):
-      vara[n] = {'map_data'          : f[::-1, :],
+    for n in names:
+      vara[n] = {'map_data'          : ftns[n]()[::-1, :],
                  'map_western_edge'  : west, 
                  'map_eastern_edge'  : east, 
                  'map_southern_edge' : south, 
@@ -76,17 +418,21 @@ class DataFactory(object):
   
   
   @staticmethod
-  def get_gre_measures():
+  @stored
+  def get_gre_measures(fields = None, dtype = None,
+                       bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
     
     sys.path.append(home + '/external_import_scripts')
-    from tifffile import TiffFile
     
     direc    = home + '/greenland/measures/greenland_vel_mosaic500_2008_2009_' 
     files    = ['sp', 'vx', 'vy', 'ex', 'ey']
     vara     = dict()
+    
+    # fields to create, and the layers they are made from :
+    files, layers = select_fields(fields, dict((f, [f]) for f in files))
      
     # extents of domain :
     nx    =  3010
@@ -96,6 +442,10 @@ class DataFactory(object):
     east  =  west  + nx*dx
     south = -3370000.0 
     north =  south + ny*dx
+    
+    # the window of the domain to read :
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, nx, ny, flip=True)
 
     #projection info :
     proj   = 'stere'
@@ -104,10 +454,13 @@ class DataFactory(object):
     lon_0  = '-45'
     
     # retrieve data :
+    l = read_layers(dict((f, lambda f=f : cast(read_tiff(direc + f + '.tif',
+                                                         rows, cols),
+                                               dtype, copy=False))
+                         for f in layers))
     vara['dataset'] = 'measures'
     for f in files:
-      data    = TiffFile(direc + f + '.tif')
-      vara[f] = {'map_data'          : data.asarray()[::-1, :],
+      vara[f] = {'map_data'          : l[f][::-1, :],
                  'map_western_edge'  : west,
                  'map_eastern_edge'  : east,  
                  'map_southern_edge' : south,
@@ -120,42 +473,52 @@ class DataFactory(object):
  
   
   @staticmethod
-  def get_gre_rignot():
+  @stored
+  def get_gre_rignot(fields = None, dtype = None,
+                     bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + '/greenland/rignot/velocity_greenland_merged_15Feb2013.nc'
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
-    # retrieve data :
-    vx   = array(data.variables['vx'][:])
-    vy   = array(data.variables['vy'][:])
-    err  = array(data.variables['err'][:])
-    vmag = sqrt(vx**2 + vy**2)
-     
-    # extents of domain :
-    m,n   =  shape(vx)
+    # fields to create, and the layers they are made from :
+    names, layers = select_fields(fields, {'vx'    : ['vx'],
+                                           'vy'    : ['vy'],
+                                           'v_err' : ['err'],
+                                           'U_ob'  : ['vx', 'vy']})
+    
+    # extents of domain, and the window of it to read :
+    v     =  data.variables
+    m,n   =  v['vx'].shape
     dx    =  150
     west  = -638000.0
     east  =  west + n*dx
     north = -657600.0
     south =  north - m*dx
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, n, m, flip=True)
 
+    # retrieve data :
+    l    = read_layers(dict((n, lambda n=n : cast(v[n][rows, cols], dtype))
+                            for n in layers))
+    ftns = {'vx'    : lambda : l['vx'],
+            'vy'    : lambda : l['vy'],
+            'v_err' : lambda : l['err'],
+            'U_ob'  : lambda : sqrt(l['vx']**2 + l['vy']**2)}
+     
     #projection info :
     proj   = 'stere'
     lat_0  = '90'
     lat_ts = '70'
     lon_0  = '-45'
     
-    names = ['vx', 'vy', 'v_err', 'U_ob']
-    ftns  = [vx, vy, err, vmag]
-    
     # save the data in matlab format :
     vara['dataset'] = 'Rignot'
-    for n, f in zip(names, ftns):
-      vara[n] = {'map_data'          : f[::-1, :],
+    for n in names:
+      vara[n] = {'map_data'          : ftns[n]()[::-1, :],
                  'map_western_edge'  : west, 
                  'map_eastern_edge'  : east, 
                  'map_southern_edge' : south, 
@@ -168,17 +531,21 @@ class DataFactory(object):
     
   
   @staticmethod
-  def get_shift_gre_measures():
+  @stored
+  def get_shift_gre_measures(fields = None, dtype = None,
+                             bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
     
     sys.path.append(home + '/external_import_scripts')
-    from tifffile import TiffFile
     
     direc    = home + '/greenland/measures/greenland_vel_mosaic500_2008_2009_' 
     files    = ['sp', 'vx', 'vy']
     vara     = dict()
+    
+    # fields to create, and the layers they are made from :
+    files, layers = select_fields(fields, dict((f, [f]) for f in files))
      
     # extents of domain :
     nx    =  3010
@@ -188,6 +555,10 @@ class DataFactory(object):
     east  =  west  + nx*dx
     south = -3370000.0 
     north =  south + ny*dx
+    
+    # the window of the domain to read :
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, nx, ny, flip=True)
 
     #projection info :
     proj   = 'stere'
@@ -196,10 +567,14 @@ class DataFactory(object):
     lon_0  = '-39'
 
     # retrieve data :
+    l = read_layers(dict((f, lambda f=f : cast(read_tiff(direc + f + 
+                                                         '_new.tif',
+                                                         rows, cols),
+                                               dtype, copy=False))
+                         for f in layers))
     vara['dataset'] = 'sft measures'
     for f in files:
-      data    = TiffFile(direc + f + '_new.tif')
-      vara[f] = {'map_data'          : data.asarray()[::-1, :],
+      vara[f] = {'map_data'          : l[f][::-1, :],
                  'map_western_edge'  : west,
                  'map_eastern_edge'  : east,  
                  'map_southern_edge' : south,
@@ -212,25 +587,31 @@ class DataFactory(object):
  
   
   @staticmethod
-  def get_gre_qgeo_fox_maule():
+  @stored
+  def get_gre_qgeo_fox_maule(fields = None, dtype = None,
+                             bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + "/greenland/fox_maule/Greenland_heat_flux_5km.nc"
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
+    # fields to create :
+    names, layers = select_fields(fields, {'q_geo' : ['bheatflx']})
+    
     # retrieve data :
     x     = array(data.variables['x1'][:])
     y     = array(data.variables['y1'][:])
-    q_geo = array(data.variables['bheatflx'][:][0]) * 60 * 60 * 24 * 365
  
-    # extents of domain :
+    # extents of domain, and the window of it to read :
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, len(x), len(y))
 
     #projection info :
     proj   = 'stere'
@@ -239,29 +620,39 @@ class DataFactory(object):
     lon_0  = '-39'
  
     vara['dataset'] = 'Fox Maule'
-    vara['q_geo'] = {'map_data'          : q_geo,
-                     'map_western_edge'  : west, 
-                     'map_eastern_edge'  : east, 
-                     'map_southern_edge' : south, 
-                     'map_northern_edge' : north,
-                     'projection'        : proj,
-                     'standard lat'      : lat_0,
-                     'standard lon'      : lon_0,
-                     'lat true scale'    : lat_ts}
+    if 'q_geo' in names:
+      q_geo = cast(data.variables['bheatflx'][0, rows, cols], dtype)
+      q_geo = q_geo * 60 * 60 * 24 * 365
+      vara['q_geo'] = {'map_data'          : q_geo,
+                       'map_western_edge'  : west, 
+                       'map_eastern_edge'  : east, 
+                       'map_southern_edge' : south, 
+                       'map_northern_edge' : north,
+                       'projection'        : proj,
+                       'standard lat'      : lat_0,
+                       'standard lon'      : lon_0,
+                       'lat true scale'    : lat_ts}
     return vara
   
   
   @staticmethod
-  def get_gre_qgeo_secret():
+  def get_gre_qgeo_secret_points(fields = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + "/greenland/secret_qgeo/ghf_10x10_2000_JVJ.dat"
-    data  = loadtxt(direc)
     vara  = dict()
     
+    # fields to create :
+    names, layers = select_fields(fields, {'q_geo' : ['q_geo']})
+    
+    vara['dataset'] = 'secret'
+    if 'q_geo' not in names:
+      return vara
+    
     # retrieve data :
+    data  = loadtxt(direc)
     lon   = data[:,2]
     lat   = data[:,3]
     q_geo = data[:,4] * 60 * 60 * 24 * 365
@@ -277,52 +668,82 @@ class DataFactory(object):
              + " +lon_0="  + lon_0 \
              + " +k=1 +x_0=0 +y_0=0 +no_defs +a=6378137 +rf=298.257223563" \
              + " +towgs84=0.000,0.000,0.000 +to_meter=1"
-    p      = Proj(proj_s)
-    x, y   = p(lon, lat)
+    key, x, y, tri = triangulate(lon, lat, proj_s)
+    
+    vara['q_geo'] = {'point_data'        : q_geo,
+                     'x'                 : x,
+                     'y'                 : y,
+                     'triangles'         : tri,
+                     'key'               : key,
+                     'projection'        : proj,
+                     'standard lat'      : lat_0,
+                     'standard lon'      : lon_0,
+                     'lat true scale'    : lat_ts}
+    return vara
+  
+  
+  @staticmethod
+  @stored
+  def get_gre_qgeo_secret(fields = None, dtype = None, res = 10000):
+    
+    points = DataFactory.get_gre_qgeo_secret_points(fields)
+    vara   = {'dataset' : points.pop('dataset')}
+    if 'q_geo' not in points:
+      return vara
+    d      = points['q_geo']
+    x, y   = d['x'], d['y']
     
     # extents of domain :
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
-    xs    = arange(west,  east,  10000)
-    ys    = arange(south, north, 10000)
+    xs    = arange(west,  east,  res)
+    ys    = arange(south, north, res)
     X, Y  = meshgrid(xs, ys)
-    q_geo = griddata((x, y), q_geo, (X, Y), fill_value=0.0)
     
-    vara['dataset'] = 'secret'
-    vara['q_geo'] = {'map_data'          : q_geo,
+    # linear interpolation onto the grid by the cached weights :
+    W     = interpolation_matrix(d['key'], x, y, d['triangles'], X, Y)
+    q_geo = (W * d['point_data']).reshape(X.shape)
+    
+    vara['q_geo'] = {'map_data'          : cast(q_geo, dtype),
                      'map_western_edge'  : west, 
                      'map_eastern_edge'  : east, 
                      'map_southern_edge' : south, 
                      'map_northern_edge' : north,
-                     'projection'        : proj,
-                     'standard lat'      : lat_0,
-                     'standard lon'      : lon_0,
-                     'lat true scale'    : lat_ts}
+                     'projection'        : d['projection'],
+                     'standard lat'      : d['standard lat'],
+                     'standard lon'      : d['standard lon'],
+                     'lat true scale'    : d['lat true scale']}
     return vara
     
   
   @staticmethod
-  def get_ant_qgeo_fox_maule():
+  @stored
+  def get_ant_qgeo_fox_maule(fields = None, dtype = None,
+                             bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + "/antarctica/fox_maule/Antarctica_heat_flux_5km.nc"
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
+    # fields to create :
+    names, layers = select_fields(fields, {'q_geo' : ['bheatflx']})
+    
     # retrieve data :
     x     = array(data.variables['x1'][:])
     y     = array(data.variables['y1'][:])
-    q_geo = array(data.variables['bheatflx'][:][0]) * 60 * 60 * 24 * 365
  
-    # extents of domain :
+    # extents of domain, and the window of it to read :
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, len(x), len(y))
 
     #projection info :
     proj   = 'stere'
@@ -331,29 +752,38 @@ class DataFactory(object):
     lon_0  = '0'
  
     vara['dataset'] = 'Fox Maule'
-    vara['q_geo'] = {'map_data'          : q_geo,
-                     'map_western_edge'  : west, 
-                     'map_eastern_edge'  : east, 
-                     'map_southern_edge' : south, 
-                     'map_northern_edge' : north,
-                     'projection'        : proj,
-                     'standard lat'      : lat_0,
-                     'standard lon'      : lon_0,
-                     'lat true scale'    : lat_ts}
+    if 'q_geo' in names:
+      q_geo = cast(data.variables['bheatflx'][0, rows, cols], dtype)
+      q_geo = q_geo * 60 * 60 * 24 * 365
+      vara['q_geo'] = {'map_data'          : q_geo,
+                       'map_western_edge'  : west, 
+                       'map_eastern_edge'  : east, 
+                       'map_southern_edge' : south, 
+                       'map_northern_edge' : north,
+                       'projection'        : proj,
+                       'standard lat'      : lat_0,
+                       'standard lon'      : lon_0,
+                       'lat true scale'    : lat_ts}
     return vara
   
-
   @staticmethod
-  def get_gre_qgeo_secret():
+  def get_gre_qgeo_secret_points(fields = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + "/greenland/secret_qgeo/ghf_10x10_2000_JVJ.dat"
-    data  = loadtxt(direc)
     vara  = dict()
     
+    # fields to create :
+    names, layers = select_fields(fields, {'q_geo' : ['q_geo']})
+    
+    vara['dataset'] = 'secret'
+    if 'q_geo' not in names:
+      return vara
+    
     # retrieve data :
+    data  = loadtxt(direc)
     lon   = data[:,2]
     lat   = data[:,3]
     q_geo = data[:,4] * 60 * 60 * 24 * 365 / 1000
@@ -369,52 +799,82 @@ class DataFactory(object):
              + " +lon_0="  + lon_0 \
              + " +k=1 +x_0=0 +y_0=0 +no_defs +a=6378137 +rf=298.257223563" \
              + " +towgs84=0.000,0.000,0.000 +to_meter=1"
-    p      = Proj(proj_s)
-    x, y   = p(lon, lat)
+    key, x, y, tri = triangulate(lon, lat, proj_s)
+    
+    vara['q_geo'] = {'point_data'        : q_geo,
+                     'x'                 : x,
+                     'y'                 : y,
+                     'triangles'         : tri,
+                     'key'               : key,
+                     'projection'        : proj,
+                     'standard lat'      : lat_0,
+                     'standard lon'      : lon_0,
+                     'lat true scale'    : lat_ts}
+    return vara
+  
+  
+  @staticmethod
+  @stored
+  def get_gre_qgeo_secret(fields = None, dtype = None, res = 10000):
+    
+    points = DataFactory.get_gre_qgeo_secret_points(fields)
+    vara   = {'dataset' : points.pop('dataset')}
+    if 'q_geo' not in points:
+      return vara
+    d      = points['q_geo']
+    x, y   = d['x'], d['y']
     
     # extents of domain :
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
-    xs    = arange(west,  east,  10000)
-    ys    = arange(south, north, 10000)
+    xs    = arange(west,  east,  res)
+    ys    = arange(south, north, res)
     X, Y  = meshgrid(xs, ys)
-    q_geo = griddata((x, y), q_geo, (X, Y), fill_value=0.0)
     
-    vara['dataset'] = 'secret'
-    vara['q_geo'] = {'map_data'          : q_geo,
+    # linear interpolation onto the grid by the cached weights :
+    W     = interpolation_matrix(d['key'], x, y, d['triangles'], X, Y)
+    q_geo = (W * d['point_data']).reshape(X.shape)
+    
+    vara['q_geo'] = {'map_data'          : cast(q_geo, dtype),
                      'map_western_edge'  : west, 
                      'map_eastern_edge'  : east, 
                      'map_southern_edge' : south, 
                      'map_northern_edge' : north,
-                     'projection'        : proj,
-                     'standard lat'      : lat_0,
-                     'standard lon'      : lon_0,
-                     'lat true scale'    : lat_ts}
+                     'projection'        : d['projection'],
+                     'standard lat'      : d['standard lat'],
+                     'standard lon'      : d['standard lon'],
+                     'lat true scale'    : d['lat true scale']}
     return vara
     
   
   @staticmethod
-  def get_ant_qgeo_fox_maule():
+  @stored
+  def get_ant_qgeo_fox_maule(fields = None, dtype = None,
+                             bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + "/antarctica/fox_maule/Antarctica_heat_flux_5km.nc"
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
+    # fields to create :
+    names, layers = select_fields(fields, {'q_geo' : ['bheatflx']})
+    
     # retrieve data :
     x     = array(data.variables['x1'][:])
     y     = array(data.variables['y1'][:])
-    q_geo = array(data.variables['bheatflx'][:][0]) * 60 * 60 * 24 * 365
  
-    # extents of domain :
+    # extents of domain, and the window of it to read :
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, len(x), len(y))
 
     #projection info :
     proj   = 'stere'
@@ -423,61 +883,80 @@ class DataFactory(object):
     lon_0  = '0'
  
     vara['dataset'] = 'Fox Maule'
-    vara['q_geo'] = {'map_data'          : q_geo,
-                     'map_western_edge'  : west, 
-                     'map_eastern_edge'  : east, 
-                     'map_southern_edge' : south, 
-                     'map_northern_edge' : north,
-                     'projection'        : proj,
-                     'standard lat'      : lat_0,
-                     'standard lon'      : lon_0,
-                     'lat true scale'    : lat_ts}
+    if 'q_geo' in names:
+      q_geo = cast(data.variables['bheatflx'][0, rows, cols], dtype)
+      q_geo = q_geo * 60 * 60 * 24 * 365
+      vara['q_geo'] = {'map_data'          : q_geo,
+                       'map_western_edge'  : west, 
+                       'map_eastern_edge'  : east, 
+                       'map_southern_edge' : south, 
+                       'map_northern_edge' : north,
+                       'projection'        : proj,
+                       'standard lat'      : lat_0,
+                       'standard lon'      : lon_0,
+                       'lat true scale'    : lat_ts}
     return vara
   
 
   @staticmethod
-  def get_bedmap1(thklim = 0.0):
+  @stored
+  def get_bedmap1(thklim = 0.0, fields = None, dtype = None,
+                  bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + '/antarctica/bedmap1/ALBMAPv1.nc'
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
-    # retrieve data :
-    x       = array(data.variables['x1'][:])
-    y       = array(data.variables['y1'][:])
-    b       = array(data.variables['lsrf'][:])
-    h       = array(data.variables['usrf'][:])
-    adot    = array(data.variables['acca'][:])
-    mask    = array(data.variables['mask'][:])
-    srfTemp = array(data.variables['temp'][:]) + 273.15
-    q_geo   = array(data.variables['ghffm'][:]) * 60 * 60 * 24 * 365 / 1000
-   
-    H             = h - b
-    h[H < thklim] = b[H < thklim] + thklim
-    H[H < thklim] = thklim
+    # fields to create, and the layers they are made from :
+    names, layers = select_fields(fields, {'B'       : ['lsrf'],
+                                           'S'       : ['lsrf', 'usrf'],
+                                           'H'       : ['lsrf', 'usrf'],
+                                           'adot'    : ['acca'],
+                                           'q_geo'   : ['ghffm'],
+                                           'srfTemp' : ['temp']})
     
-    # extents of domain :
+    # extents of domain, and the window of it to read :
+    v       = data.variables
+    x       = array(v['x1'][:])
+    y       = array(v['y1'][:])
     east    = max(x)
     west    = min(x)
     north   = max(y)
     south   = min(y)
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, len(x), len(y))
 
+    # retrieve data :
+    l       = read_layers(dict((n, lambda n=n : cast(v[n][rows, cols], dtype)) 
+                               for n in layers))
+    b       = l.get('lsrf')
+    h       = l.get('usrf')
+   
+    if 'usrf' in l:
+      H             = h - b
+      h[H < thklim] = b[H < thklim] + thklim
+      H[H < thklim] = thklim
+    
+    ftns = {'B'       : lambda : b,
+            'S'       : lambda : h,
+            'H'       : lambda : H,
+            'adot'    : lambda : l['acca'],
+            'q_geo'   : lambda : l['ghffm'] * 60 * 60 * 24 * 365 / 1000,
+            'srfTemp' : lambda : l['temp'] + 273.15}
+    
     #projection info :
     proj   = 'stere'
     lat_0  = '-90'
     lat_ts = '-71'
     lon_0  = '0'
     
-    names = ['B', 'S', 'H', 'adot', 'q_geo', 'srfTemp']
-    ftns  = [ b,   h,   H,   adot,   q_geo,   srfTemp]
-    
     # save the data in matlab format :
     vara['dataset'] = 'bedmap 1'
-    for n, f in zip(names, ftns):
-      vara[n] = {'map_data'          : f,
+    for n in names:
+      vara[n] = {'map_data'          : ftns[n](),
                  'map_western_edge'  : west, 
                  'map_eastern_edge'  : east, 
                  'map_southern_edge' : south, 
@@ -490,59 +969,67 @@ class DataFactory(object):
   
   
   @staticmethod
-  def get_bedmap2(thklim = 0.0):
+  @stored
+  def get_bedmap2(thklim = 0.0, fields = None, dtype = None,
+                  bbox = None):
 
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
     direc    = home + '/antarctica/bedmap2/bedmap2_tiff/' 
 
     sys.path.append(home + '/external_import_scripts')
-    from tifffile import TiffFile
-   
-    b           = TiffFile(direc + 'bedmap2_bed.tif')
-    h           = TiffFile(direc + 'bedmap2_surface.tif') 
-    H           = TiffFile(direc + 'bedmap2_thickness.tif')
-    mask        = TiffFile(direc + 'bedmap2_icemask_grounded_and_shelves.tif') 
-    rock_mask   = TiffFile(direc + 'bedmap2_rockmask.tif') 
-    b_uncert    = TiffFile(direc + 'bedmap2_grounded_bed_uncertainty.tif') 
-    coverage    = TiffFile(direc + 'bedmap2_coverage.tif')
-    gl04c_WGS84 = TiffFile(direc + 'gl04c_geiod_to_WGS84.tif')
-   
-    b           = b.asarray()
-    h           = h.asarray()
-    H           = H.asarray()
-    mask        = mask.asarray()
-    rock_mask   = rock_mask.asarray()
-    b_uncert    = b_uncert.asarray()
-    coverage    = coverage.asarray() 
-    gl04c_WGS84 = gl04c_WGS84.asarray()
-    
-    h[H < thklim] = b[H < thklim] + thklim
-    H[H < thklim] = thklim
-
-    vara        = dict()
-     
-    # extents of domain :
+    
+    files = {'B'           : 'bedmap2_bed.tif',
+             'S'           : 'bedmap2_surface.tif',
+             'H'           : 'bedmap2_thickness.tif',
+             'mask'        : 'bedmap2_icemask_grounded_and_shelves.tif',
+             'rock_mask'   : 'bedmap2_rockmask.tif',
+             'b_uncert'    : 'bedmap2_grounded_bed_uncertainty.tif',
+             'coverage'    : 'bedmap2_coverage.tif',
+             'gl04c_WGS84' : 'gl04c_geiod_to_WGS84.tif'}
+    masks = ['mask', 'rock_mask', 'coverage']
+    
+    # extents of domain, and the window of it to read :
     dx    =  1000
     west  = -3333500.0
     east  =  3333500.0
     north =  3333500.0
     south = -3333500.0
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, 6667, 6667, flip=True)
+    
+    # fields to create, and the layers they are made from :
+    needs         = dict((n, [n]) for n in files.keys())
+    needs['S']    = ['S', 'H', 'B']
+    names, layers = select_fields(fields, needs)
+    
+    # the masks are stored as small integers, the rest as <dtype> :
+    def read(n):
+      if n in masks:
+        return as_mask(read_tiff(direc + files[n], rows, cols))
+      return cast(read_tiff(direc + files[n], rows, cols), dtype, copy=False)
+    
+    l = read_layers(dict((n, lambda n=n : read(n)) for n in layers))
+    
+    if 'S' in l:
+      b, h, H       = l['B'], l['S'], l['H']
+      h[H < thklim] = b[H < thklim] + thklim
+    if 'H' in l:
+      H             = l['H']
+      H[H < thklim] = thklim
 
+    vara        = dict()
+     
     #projection info :
     proj   = 'stere'
     lat_0  = '-90'
     lat_ts = '-71'
     lon_0  = '0'
-    
-    names = ['B', 'S', 'H', 'mask', 'rock_mask', 'b_uncert', 
-             'coverage', 'gl04c_WGS84']
-    ftns  = [b, h, H, mask, rock_mask, b_uncert, coverage, gl04c_WGS84]
    
     # retrieve data :
     vara['dataset'] = 'bedmap 2'
-    for n, f in zip(names, ftns):
-      vara[n] = {'map_data'          : f[::-1, :],
+    for n in names:
+      vara[n] = {'map_data'          : l[n][::-1, :],
                  'map_western_edge'  : west,
                  'map_eastern_edge'  : east,  
                  'map_southern_edge' : south,
@@ -555,46 +1042,65 @@ class DataFactory(object):
 
   
   @staticmethod
-  def get_bamber(thklim = 0.0):
+  @stored
+  def get_bamber(thklim = 0.0, fields = None, dtype = None,
+                 bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
    
     direc = home + '/greenland/bamber13/Greenland_bedrock_topography_V2.nc' 
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
-    # retrieve data :
-    x    = array(data.variables['projection_x_coordinate'][:])
-    y    = array(data.variables['projection_y_coordinate'][:])
-    b    = array(data.variables['BedrockElevation'][:])
-    h    = array(data.variables['SurfaceElevation'][:])
-    H    = array(data.variables['IceThickness'][:])
-    Herr = array(data.variables['BedrockError'][:])
-    mask = array(data.variables['IceShelfSourceMask'][:])
+    # names of the layers of each field :
+    var   = {'B'    : 'BedrockElevation',
+             'S'    : 'SurfaceElevation',
+             'H'    : 'IceThickness',
+             'Herr' : 'BedrockError',
+             'mask' : 'IceShelfSourceMask'}
     
-    h[H < thklim] = b[H < thklim] + thklim
-    H[H < thklim] = thklim
-
-    # extents of domain :
+    # fields to create, and the layers they are made from :
+    needs         = dict((n, [n]) for n in var.keys())
+    needs['S']    = ['S', 'H', 'B']
+    names, layers = select_fields(fields, needs)
+    
+    # extents of domain, and the window of it to read :
+    v     = data.variables
+    x     = array(v['projection_x_coordinate'][:])
+    y     = array(v['projection_y_coordinate'][:])
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, len(x), len(y))
+
+    # retrieve data, with the mask stored as small integers :
+    def read(n):
+      if n == 'mask':
+        return as_mask(v[var[n]][rows, cols])
+      return cast(v[var[n]][rows, cols], dtype)
+    
+    l    = read_layers(dict((n, lambda n=n : read(n)) for n in layers))
+    
+    if 'S' in l:
+      b, h, H       = l['B'], l['S'], l['H']
+      h[H < thklim] = b[H < thklim] + thklim
+    if 'H' in l:
+      H             = l['H']
+      H[H < thklim] = thklim
 
     #projection info :
     proj   = 'stere'
     lat_0  = '90'
     lat_ts = '71'
     lon_0  = '-39'
-     
-    names = ['B', 'S', 'H', 'Herr', 'mask']
-    ftns  = [ b,   h,   H,   Herr,   mask]
     
     # save the data in matlab format :
     vara['dataset'] = 'Bamber'
-    for n, f in zip(names, ftns):
-      vara[n] = {'map_data'          : f,
+    for n in names:
+      vara[n] = {'map_data'          : l[n],
                  'map_western_edge'  : west, 
                  'map_eastern_edge'  : east, 
                  'map_southern_edge' : south, 
@@ -607,56 +1113,81 @@ class DataFactory(object):
   
   
   @staticmethod
-  def get_searise(thklim = 0.0):
+  @stored
+  def get_searise(thklim = 0.0, fields = None, dtype = None,
+                  bbox = None):
     
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     home     = os.path.dirname(os.path.abspath(filename))
  
     direc = home + "/greenland/searise/Greenland_5km_dev1.2.nc"
-    data  = netcdf_file(direc, mode = 'r')
+    data  = netcdf_file(direc, mode = 'r', mmap = True)
     vara  = dict()
     
-    # retrieve data :
-    x     = array(data.variables['x1'][:])
-    y     = array(data.variables['y1'][:])
-    h     = array(data.variables['usrf'][:][0])
-    adot  = array(data.variables['smb'][:][0])
-    b     = array(data.variables['topg'][:][0])
-    T     = array(data.variables['surftemp'][:][0]) + 273.15
-    q_geo = array(data.variables['bheatflx'][:][0]) * 60 * 60 * 24 * 365
-    lat   = array(data.variables['lat'][:][0])
-    lon   = array(data.variables['lon'][:][0])
-    U_sar = array(data.variables['surfvelmag'][:][0])
-    dhdt  = array(data.variables['dhdt'][:][0])
- 
-    direc = home + "/greenland/searise/smooth_target.mat" 
-    U_ob  = loadmat(direc)['st']
-    
-    H             = h - b
-    h[H < thklim] = b[H < thklim] + thklim
-    H[H < thklim] = thklim
-
-    Tn            = 41.83 - 6.309e-3*h - 0.7189*lat - 0.0672*lon + 273
+    # fields to create, and the layers they are made from :
+    surf          = ['usrf', 'topg']
+    names, layers = select_fields(fields, {'H'     : surf,
+                                           'S'     : surf,
+                                           'adot'  : ['smb'],
+                                           'B'     : ['topg'],
+                                           'T'     : ['surftemp'],
+                                           'q_geo' : ['bheatflx'],
+                                           'U_sar' : ['surfvelmag'],
+                                           'U_ob'  : ['U_ob'],
+                                           'lat'   : ['lat'],
+                                           'lon'   : ['lon'],
+                                           'Tn'    : surf + ['lat', 'lon'],
+                                           'dhdt'  : ['dhdt']})
     
-    # extents of domain :
+    # extents of domain, and the window of it to read :
+    v     = data.variables
+    x     = array(v['x1'][:])
+    y     = array(v['y1'][:])
     east  = max(x)
     west  = min(x)
     north = max(y)
     south = min(y)
+    rows, cols, (west, east, south, north) = \
+        grid_window(bbox, west, east, south, north, len(x), len(y))
+
+    # retrieve data, the smoothed velocity along with the netCDF layers :
+    st    = home + "/greenland/searise/smooth_target.mat" 
+    r     = dict((n, lambda n=n : cast(v[n][0, rows, cols], dtype)) 
+                 for n in layers)
+    if 'U_ob' in layers:
+      r['U_ob'] = lambda : cast(loadmat(st)['st'][rows, cols], dtype)
+    l     = read_layers(r)
+    h     = l.get('usrf')
+    b     = l.get('topg')
+    
+    if 'usrf' in l:
+      H             = h - b
+      h[H < thklim] = b[H < thklim] + thklim
+      H[H < thklim] = thklim
 
+    ftns  = {'H'     : lambda : H,
+             'S'     : lambda : h,
+             'adot'  : lambda : l['smb'],
+             'B'     : lambda : b,
+             'T'     : lambda : l['surftemp'] + 273.15,
+             'q_geo' : lambda : l['bheatflx'] * 60 * 60 * 24 * 365,
+             'U_sar' : lambda : l['surfvelmag'],
+             'U_ob'  : lambda : l['U_ob'],
+             'lat'   : lambda : l['lat'],
+             'lon'   : lambda : l['lon'],
+             'Tn'    : lambda : 41.83 - 6.309e-3*h - 0.7189*l['lat'] \
+                                - 0.0672*l['lon'] + 273,
+             'dhdt'  : lambda : l['dhdt']}
+    
     #projection info :
     proj   = 'stere'
     lat_0  = '90'
     lat_ts = '71'
     lon_0  = '-39'
  
-    names = ['H', 'S', 'adot', 'B', 'T', 'q_geo','U_sar', \
-             'U_ob', 'lat', 'lon', 'Tn','dhdt']
-    ftns  = [H, h, adot, b, T, q_geo,U_sar, U_ob, lat, lon, Tn, dhdt]
-
     vara['dataset'] = 'searise'
-    for n, f in zip(names, ftns):
-      vara[n] = {'map_data'          : f,
+    for n in names:
+      vara[n] = {'map_data'          : ftns[n](),
                  'map_western_edge'  : west, 
                  'map_eastern_edge'  : east, 
                  'map_southern_edge' : south, 
@@ -666,6 +1197,3 @@ class DataFactory(object):
                  'standard lon'      : lon_0,
                  'lat true scale'    : lat_ts}
     return vara
- 
-
-
@@ -1338,6 +1338,72 @@ class TiffPage(object):
 
         return result
 
+    def asarray_window(self, rows, cols):
+        """Read a window of image data from file and return as numpy array.
+
+        Only the rows ``rows[0]:rows[1]`` and columns ``cols[0]:cols[1]``
+        are returned.  For grayscale images stored in strips, only the
+        strips overlapping the rows are read and decompressed, and for
+        uncompressed contiguous images only the rows are read.  Other
+        images are read whole with asarray() and then sliced.
+
+        """
+        fh = self.parent._fh
+        if not fh:
+            raise IOError("TIFF file is not open")
+        r0, r1 = rows
+        c0, c1 = cols
+        bits_per_sample = self.bits_per_sample
+        if (self.is_tiled or self.is_palette or self.dtype is None
+                or len(self.shape) != 2 or self.samples_per_pixel != 1
+                or bits_per_sample not in (8, 16, 32, 64)
+                or self.compression not in TIFF_DECOMPESSORS
+                or (self.parent.is_lsm and not self.compression)):
+            return self.asarray()[r0:r1, c0:c1]
+
+        dtype = self.dtype
+        typecode = self.parent.byteorder + dtype
+        width = self.image_width
+        rowbytes = width * bits_per_sample // 8
+        byte_counts = self.strip_byte_counts
+        offsets = self.strip_offsets
+        try:
+            offsets[0]
+        except TypeError:
+            offsets = (offsets, )
+            byte_counts = (byte_counts, )
+        rows_per_strip = min(self.rows_per_strip, self.image_length)
+
+        if r1 <= r0 or c1 <= c0:
+            return numpy.empty((max(r1-r0, 0), max(c1-c0, 0)), '=' + dtype)
+
+        if (not self.compression
+                and all(offsets[i] == offsets[i+1] - byte_counts[i]
+                        for i in range(len(offsets)-1))):
+            # contiguous data
+            fh.seek(offsets[0] + r0 * rowbytes)
+            result = numpy_fromfile(fh, typecode, (r1-r0) * width)
+            result.shape = (r1-r0, width)
+            if self.predictor == 'horizontal':
+                numpy.cumsum(result, axis=1, dtype=dtype, out=result)
+            return result[:, c0:c1].astype('=' + dtype)
+
+        decompress = TIFF_DECOMPESSORS[self.compression]
+        result = numpy.empty((r1-r0, c1-c0), '=' + dtype)
+        for k in range(r0 // rows_per_strip, (r1-1) // rows_per_strip + 1):
+            fh.seek(offsets[k])
+            strip = numpy.fromstring(decompress(fh.read(byte_counts[k])),
+                                     typecode)
+            strip = strip[:(strip.size // width) * width]
+            strip.shape = (-1, width)
+            if self.predictor == 'horizontal':
+                numpy.cumsum(strip, axis=1, dtype=dtype, out=strip)
+            s0 = k * rows_per_strip
+            a = max(r0, s0)
+            b = min(r1, s0 + strip.shape[0])
+            result[a-r0:b-r0] = strip[a-s0:b-s0, c0:c1]
+        return result
+
     def __str__(self):
         """Return string containing information about page."""
         s = ', '.join(s for s in (
@@ -1998,12 +2064,151 @@ def _replace_by(module_function, package=None, warn=True):
     return decorate
 
 
-#@_replace_by('_tifffile.decodepackbits')
+@_replace_by('_tifffile.decodepackbits', warn=False)
 def decodepackbits(encoded):
     """Decompress PackBits encoded byte string.
 
     PackBits is a simple byte-oriented run-length compression scheme.
 
+    The run headers are read from a bytearray, which yields integers on
+    Python 2 and 3, and every run is copied or repeated as one string
+    operation.  Replaced by the compiled _tifffile.decodepackbits if that
+    module is available.
+
+    """
+    header = bytearray(encoded)
+    len_encoded = len(header)
+    result = []
+    result_append = result.append
+    i = 0
+    while i < len_encoded:
+        n = header[i]
+        i += 1
+        if n < 128:
+            result_append(encoded[i:i+n+1])
+            i += n + 1
+        elif n > 128:
+            result_append(encoded[i:i+1] * (257-n))
+            i += 1
+    return b''.join(result)
+
+
+@_replace_by('_tifffile.decodelzw', warn=False)
+def decodelzw(encoded):
+    """Decompress LZW (Lempel-Ziv-Welch) encoded TIFF strip (byte string).
+
+    The strip must begin with a CLEAR code and end with an EOI code.
+
+    This is an implementation of the LZW decoding algorithm described in (1).
+    It is not compatible with old style LZW compressed files like quad-lzw.tif.
+
+    The width of every code until the next CLEAR code follows from the
+    number of codes read since the last one, so the codes are unpacked in
+    bulk with numpy, up to the next expected CLEAR code at a time, and only
+    the table lookups are done in Python.  The result is identical to that
+    of _decodelzw_bytewise().  Replaced by the compiled _tifffile.decodelzw
+    if that module is available.
+
+    """
+    len_encoded = len(encoded)
+    bitcount_max = len_encoded * 8
+
+    if len_encoded < 4:
+        raise ValueError("strip must be at least 4 characters long")
+
+    # zero padded, so that a batch of codes may be read past the end :
+    data = numpy.zeros(len_encoded + 6160, 'int64')
+    data[:len_encoded] = numpy.frombuffer(encoded, 'uint8')
+
+    def read_codes(bitcount, lentable, after_clear):
+        """Return the codes following bit `bitcount` and the bit position
+        after each, assuming no CLEAR code among them."""
+        n = max(4094 - lentable, 0) + 16
+        lentables = numpy.arange(lentable, lentable + n)
+        widths = (9 + (lentables >= 511) + (lentables >= 1023) +
+                  (lentables >= 2047))
+        if after_clear:
+            widths = numpy.concatenate(([9], widths))
+        ends = bitcount + numpy.cumsum(widths)
+        starts = ends - widths
+        index = starts >> 3
+        words = (data[index] << 16) | (data[index+1] << 8) | data[index+2]
+        codes = (words >> (24 - widths - (starts & 7))) & ((1 << widths) - 1)
+        return codes, ends
+
+    if read_codes(0, 258, False)[0][0] != 256:
+        raise ValueError("strip must begin with CLEAR code")
+
+    if sys.version[0] == '2':
+        newtable = [chr(i) for i in range(256)]
+    else:
+        newtable = [bytes([i]) for i in range(256)]
+    newtable.extend((0, 0))
+
+    code = 0
+    oldcode = 0
+    lentable = 258
+    bitcount = 0
+    after_clear = False
+    result = []
+    result_append = result.append
+    while True:
+        codes, ends = read_codes(bitcount, lentable, after_clear)
+        k = 0
+        if after_clear:
+            # the first code after a CLEAR code :
+            after_clear = False
+            code = int(codes[0])
+            bitcount = int(ends[0])
+            if code == 257:  # EOI
+                break
+            result_append(table[code])
+            oldcode = code
+            k = 1
+        # the codes up to the next CLEAR or EOI code or the end of the strip
+        # only add to the table :
+        stops = numpy.flatnonzero((codes[k:] == 256) | (codes[k:] == 257) |
+                                  (ends[k:] >= bitcount_max))
+        stop = k + stops[0] if len(stops) else len(codes)
+        for code in codes[k:stop].tolist():
+            if code < lentable:
+                decoded = table[code]
+                newcode = table[oldcode] + decoded[:1]
+            else:
+                newcode = table[oldcode]
+                newcode += newcode[:1]
+                decoded = newcode
+            result_append(decoded)
+            table_append(newcode)
+            lentable += 1
+            oldcode = code
+        if stop == len(codes):
+            bitcount = int(ends[-1])
+            continue
+        code = int(codes[stop])
+        bitcount = int(ends[stop])
+        if code == 257 or bitcount >= bitcount_max:  # EOI
+            break
+        # CLEAR :
+        table = newtable[:]
+        table_append = table.append
+        lentable = 258
+        after_clear = True
+
+    if code != 257:
+        warnings.warn(
+            "decodelzw encountered unexpected end of stream (code %i)" % code)
+
+    return b''.join(result)
+
+
+def _decodepackbits_bytewise(encoded):
+    """Decompress PackBits encoded byte string, one run at a time.
+
+    Reference implementation used by benchmark_decoders().
+
+    PackBits is a simple byte-oriented run-length compression scheme.
+
     """
     func = ord if sys.version[0] == '2' else lambda x: x
     result = []
@@ -2024,10 +2229,11 @@ def decodepackbits(encoded):
     return b''.join(result) if sys.version[0] == '2' else bytes(result)
 
 
-#@_replace_by('_tifffile.decodelzw')
-def decodelzw(encoded):
+def _decodelzw_bytewise(encoded):
     """Decompress LZW (Lempel-Ziv-Welch) encoded TIFF strip (byte string).
 
+    Reference implementation used by benchmark_decoders().
+
     The strip must begin with a CLEAR code and end with an EOI code.
 
     This is an implementation of the LZW decoding algorithm described in (1).
@@ -2364,6 +2570,139 @@ def test_tifffile(directory='testimages', verbose=True):
             successful, successful+failed, time.time()-start))
 
 
+def _encodepackbits(data):
+    """Return PackBits encoded byte string. Used by benchmark_decoders()."""
+    data = bytearray(data)
+    n = len(data)
+    result = bytearray()
+    i = 0
+    while i < n:
+        j = i + 1
+        while j < n and j - i < 128 and data[j] == data[i]:
+            j += 1
+        if j - i > 1:
+            result.append(257 - (j - i))
+            result.append(data[i])
+        else:
+            while j < n and j - i < 128 and not (
+                    j + 1 < n and data[j] == data[j+1]):
+                j += 1
+            result.append(j - i - 1)
+            result.extend(data[i:j])
+        i = j
+    return bytes(result)
+
+
+def _encodelzw(data):
+    """Return TIFF LZW encoded byte string. Used by benchmark_decoders()."""
+    data = bytearray(data)
+    result = bytearray()
+    state = [0, 0]  # bit buffer, number of bits in buffer
+
+    def emit(code, bitw):
+        state[0] = (state[0] << bitw) | code
+        state[1] += bitw
+        while state[1] >= 8:
+            state[1] -= 8
+            result.append((state[0] >> state[1]) & 255)
+        state[0] &= (1 << state[1]) - 1
+
+    def width(nextcode):
+        # the decoder's table is one entry behind the encoder's
+        if nextcode < 512:
+            return 9
+        if nextcode < 1024:
+            return 10
+        if nextcode < 2048:
+            return 11
+        return 12
+
+    table = dict((bytes(bytearray([i])), i) for i in range(256))
+    nextcode = 258
+    emit(256, 9)
+    w = b''
+    for i in range(len(data)):
+        c = bytes(data[i:i+1])
+        wc = w + c
+        if wc in table:
+            w = wc
+            continue
+        emit(table[w], width(nextcode))
+        table[wc] = nextcode
+        nextcode += 1
+        w = c
+        if nextcode == 4094:
+            emit(256, 12)
+            table = dict((bytes(bytearray([i])), i) for i in range(256))
+            nextcode = 258
+    if w:
+        emit(table[w], width(nextcode))
+        nextcode += 1
+    emit(257, width(nextcode))
+    if state[1]:
+        result.append((state[0] << (8 - state[1])) & 255)
+    return bytes(result)
+
+
+def benchmark_decoders(filename=None, rows=8, width=6667, repeat=3):
+    """Time the PackBits and LZW decoders against the bytewise reference
+    implementations and check that they produce the same bytes.
+
+    If `filename` is given, the strips or tiles of the first page of that
+    TIFF file are decoded with its codec.  Otherwise synthetic strips of
+    `rows` rows of `width` 16-bit samples, the size of a Bedmap2 strip, are
+    encoded with both codecs and decoded.
+
+    """
+    if filename is not None:
+        with TiffFile(filename) as tif:
+            page = tif[0]
+            if page.is_tiled and 'tile_offsets' in page.tags:
+                offsets = page.tile_offsets
+                byte_counts = page.tile_byte_counts
+            else:
+                offsets = page.strip_offsets
+                byte_counts = page.strip_byte_counts
+            try:
+                offsets[0]
+            except TypeError:
+                offsets = (offsets, )
+                byte_counts = (byte_counts, )
+            strips = []
+            for offset, bytecount in zip(offsets, byte_counts):
+                tif._fh.seek(offset)
+                strips.append(tif._fh.read(bytecount))
+            codecs = {page.compression: strips}
+    else:
+        x = numpy.linspace(0, 8*math.pi, width)
+        y = numpy.arange(rows)[:, numpy.newaxis]
+        surface = 1000 * numpy.sin(x) * numpy.cos(y / 4.0) + 2000
+        surface[:, :width//4] = 32767  # no-data region
+        raw = surface.astype('>i2').tostring()
+        codecs = {'packbits': [_encodepackbits(raw)],
+                  'lzw': [_encodelzw(raw)]}
+
+    decoders = {'packbits': (decodepackbits, _decodepackbits_bytewise),
+                'lzw': (decodelzw, _decodelzw_bytewise)}
+    for codec, strips in codecs.items():
+        if codec not in decoders:
+            print("%s: no decoder to benchmark" % codec)
+            continue
+        nbytes = sum(len(s) for s in strips)
+        times = []
+        results = []
+        for decode in decoders[codec]:
+            t0 = time.time()
+            for i in range(repeat):
+                result = [decode(s) for s in strips]
+            times.append((time.time() - t0) / repeat)
+            results.append(result)
+        print("%s: %i strip(s), %i bytes, %.4f s (reference %.4f s), "
+              "%.1fx faster, identical: %s" % (
+                  codec, len(strips), nbytes, times[0], times[1],
+                  times[1] / max(times[0], 1e-9), results[0] == results[1]))
+
+
 class TIFF_SUBFILE_TYPES(object):
     def __getitem__(self, key):
         result = []
@@ -25,9 +25,12 @@ set_log_active(True)
 
 thklim = 200.0
 
-measures  = DataFactory.get_ant_measures(res=900)
-bedmap1   = DataFactory.get_bedmap1(thklim=thklim)
-bedmap2   = DataFactory.get_bedmap2(thklim=thklim)
+# only read the layers used below :
+measures  = DataFactory.get_ant_measures(res=900, fields=['U_ob'])
+bedmap1   = DataFactory.get_bedmap1(thklim=thklim, 
+                                    fields=['srfTemp', 'q_geo', 'adot'])
+bedmap2   = DataFactory.get_bedmap2(thklim=thklim, dtype='float32',
+                                    fields=['H', 'S', 'B', 'mask'])
 
 mesh = MeshFactory.get_antarctica_coarse()
 
@@ -8,7 +8,7 @@ import src.physical_constants as pc
 import src.model              as model
 from meshes.mesh_factory  import MeshFactory
 from data.data_factory    import DataFactory
-from src.helper           import default_nonlin_solver_params
+from src.helper           import default_nonlin_solver_params, timers
 from src.utilities        import DataInput, DataOutput
 from fenics               import *
 from time                 import time
@@ -26,16 +26,20 @@ set_log_active(True)
 
 thklim = 200.0
 
-# collect the raw data :
-searise  = DataFactory.get_searise(thklim = thklim)
-bamber   = DataFactory.get_bamber(thklim = thklim)
-fm_qgeo  = DataFactory.get_gre_qgeo_fox_maule()
+# collect the raw data, reading the datasets concurrently :
+calls    = [('get_searise',            {'thklim' : thklim}),
+            ('get_bamber',             {'thklim' : thklim}),
+            ('get_gre_qgeo_fox_maule', {}),
+            ('get_gre_rignot',         {})]
+searise, bamber, fm_qgeo, rignot = DataFactory.get_concurrently(calls)
 #measure  = DataFactory.get_gre_measures()
-rignot   = DataFactory.get_gre_rignot()
 
 # define the mesh :
 mesh = MeshFactory.get_greenland_coarse()
 
+# keep the fields sampled onto the mesh between runs :
+DataInput.cache_dir = 'cache/'
+
 # create data objects to use with varglas :
 dsr     = DataInput(None, searise,  mesh=mesh)
 dbm     = DataInput(None, bamber,   mesh=mesh)
@@ -48,15 +52,18 @@ drg     = DataInput(None, rignot,   mesh=mesh)
 drg.change_projection(dsr)
 
 # get the expressions used by varglas :
-Thickness          = dbm.get_spline_expression('H')
 Surface            = dbm.get_spline_expression('S')
 Bed                = dbm.get_spline_expression('B')
-SurfaceTemperature = dsr.get_spline_expression('T')
-#BasalHeatFlux      = dsr.get_spline_expression('q_geo')
-BasalHeatFlux      = dfm.get_spline_expression('q_geo')
-adot               = dsr.get_spline_expression('adot')
-#U_observed         = dsr.get_spline_expression('U_ob')
-U_observed         = drg.get_spline_expression('U_ob')
+
+# the rest are sampled at the dofs of the mesh directly, or read from the 
+# cache if a previous run has sampled them onto the same mesh :
+Thickness          = dbm.get_interpolation('H')
+SurfaceTemperature = dsr.get_interpolation('T')
+#BasalHeatFlux      = dsr.get_interpolation('q_geo')
+BasalHeatFlux      = dfm.get_interpolation('q_geo')
+adot               = dsr.get_interpolation('adot')
+#U_observed         = dsr.get_interpolation('U_ob')
+U_observed         = drg.get_interpolation('U_ob')
 
 # inspect the data values :
 #do    = DataOutput('results_pre/')
@@ -95,7 +102,10 @@ config = { 'mode'                         : 'steady',
            { 
              'on'                  : True,
              'inner_tol'           : 0.0,
-             'max_iter'            : 5
+             'rel_tol'             : 1e-3,
+             'max_iter'            : 5,
+             'acceleration'        : 'anderson',
+             'anderson_depth'      : 3
            },                      
            'velocity' :            
            {                       
@@ -158,7 +168,7 @@ model.eps_reg = 1e-15
 
 F = solvers.SteadySolver(model,config)
 if i != 0: 
-  File(dir_b + str(i-1) + '/beta2.xml') >> model.beta2
+  model.read_fields(dir_b + str(i-1) + '/state.h5', ['beta2'])
   config['velocity']['approximation'] = 'stokes'
 t01 = time()
 F.solve()
@@ -179,7 +189,7 @@ config['adjoint']['control_variable']  = [model.beta2]
 
 A = solvers.AdjointSolver(model,config)
 A.set_target_velocity(U = U_observed)
-if i != 0: File(dir_b + str(i-1) + '/beta2.xml') >> model.beta2
+if i != 0: model.read_fields(dir_b + str(i-1) + '/state.h5', ['beta2'])
 t02 = time()
 A.solve()
 tf2 = time()
@@ -192,20 +202,12 @@ File(out_dir + 'w.xml')       << project(model.w, model.Q)
 File(out_dir + 'beta2.xml')   << model.beta2
 File(out_dir + 'eta.xml')     << project(model.eta, model.Q)
 
-#XDMFFile(mesh.mpi_comm(), out_dir + 'mesh.xdmf')   << model.mesh
-#
-## save the state of the model :
-#if i !=0: rw = 'a'
-#else:     rw = 'w'
-#f = HDF5File(out_dir + '3D_5H_stokes.h5', rw)
-#f.write(model.mesh,  'mesh')
-#f.write(model.beta2, 'beta2')
-#f.write(model.Mb,    'Mb')
-#f.write(model.T,     'T')
-#f.write(model.S,     'S')
-#f.write(model.B,     'B')
-#f.write(model.U,     'U')
-#f.write(model.eta,   'eta')
+# save the state of the model, the mesh, beta2, Mb, T, W, U, eta, ... :
+model.save_state(out_dir + 'state.h5', config)
+
+# time spent in each solve, projection and file write, and the iterations :
+timers.report()
+timers.dump(out_dir + 'timers.json')
 
 # calculate total time to compute
 s = (tf1 - t01) + (tf2 - t02)
@@ -47,6 +47,16 @@ config = { 'mode'                         : 'transient',
            'wall_markers'                 : [],
            'periodic_boundary_conditions' : False,
            'log'                          : True, 
+           'time_stepping' :
+           {
+             'adaptive'       : True,
+             'cfl'            : 0.5,
+             'tol'            : 1.0,
+             'dt_min'         : 0.01,
+             'dt_max'         : 5.0,
+             'velocity_every' : 5,
+             'velocity_tol'   : 10.0
+           },
            'coupled' : 
            { 
              'on'        : False,
@@ -84,7 +94,8 @@ config = { 'mode'                         : 'transient',
              'thklim'                     : 50.0,
              'use_pdd'                    : False,
              'use_shock_capturing'        : False,
-             'static_boundary_conditions' : True
+             'static_boundary_conditions' : True,
+             'time_scheme'                : 'backward_euler'
            },  
            'age' : 
            { 
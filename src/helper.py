@@ -36,8 +36,11 @@ The Hessian of the velocity norm is used in calculating error metrics of the
 meshes used in the simulations.
 """
 
-from dolfin import *
+from dolfin     import *
+from contextlib import contextmanager
+from time       import time
 import pylab as p
+import json
 
 
 def download_file(url, direc, folder, extract=False):
@@ -537,29 +540,16 @@ def default_nonlin_solver_params():
 def calculate_vertical_average(model,u):
   """
   Calculates the vertical average of a given function space and function.  
+  The integrals from the bed are found with Model.vert_integrate, a 
+  cumulative sum up the columns of layered meshes.
   
   :param model: An instantiated 2D flowline ice :class:`~src.model.Model`
   :param u: Function representing the model's function space
   :rtype: Dolfin projection and Function of the vertical average
   """
-  uhat = TrialFunction(model.Q)
-  Hhat = TrialFunction(model.Q)
-  phi  = TestFunction(model.Q)
-
-  a_u  = uhat.dx(2) * phi*dx
-  L_u  = u*phi*dx
-  
-  a_H  = Hhat.dx(2)*phi*dx
-  L_H  = 1.0*phi*dx
-     
-  bc_u = DirichletBC(model.Q,u,3)
-  bc_H = DirichletBC(model.Q,0,3)
-
-  ubar = Function(model.Q)
-  H    = Function(model.Q)
-   
-  solve(a_u == L_u,ubar,bc_u)
-  solve(a_H == L_H,H,bc_H)
+  # the integral of u from the bed, offset by the value of u on the bed :
+  ubar = model.vert_integrate(u) + model.extrude(u, 3, 2)
+  H    = model.vert_integrate(Constant(1.0))
 
   ubar = project(ubar/H,model.Q)
   return ubar
@@ -675,6 +665,39 @@ def generate_expression_from_gridded_data(x,y,var,kx=1,ky=1):
   return DolfinExpression
 
 
+def get_columns(Q):
+  """
+  Returns an array of the indices of the degrees of freedom of scalar 
+  FunctionSpace <Q> in each vertical column of the mesh, one row per 
+  column ordered from the bed to the surface, or None if the mesh is not 
+  a layered extrusion with the same number of degrees of freedom in every
+  column, or is distributed.  The columns are found once for each space,
+  and kept on the space itself, so they are freed with it.
+  """
+  if hasattr(Q, 'vertical_columns'):
+    return Q.vertical_columns
+  
+  mesh = Q.mesh()
+  gdim = mesh.geometry().dim()
+  x    = Q.dofmap().tabulate_all_coordinates(mesh).reshape((-1, gdim))
+  cols = None
+  
+  # degrees of freedom with the same x and y, sorted by x, y and then z :
+  if gdim == 3 and len(x) == Q.dim():
+    order = p.lexsort((x[:,2], x[:,1], x[:,0]))
+    xo    = x[order]
+    new   = p.flatnonzero(p.r_[True, (p.diff(xo[:,0]) != 0) | 
+                                       (p.diff(xo[:,1]) != 0)])
+    n_l   = len(x) / len(new)
+    if n_l > 1 and p.all(new == p.arange(len(new)) * n_l):
+      cols = order.reshape((len(new), n_l))
+  
+  if cols is None:
+    print "::: mesh is not layered, using the PDE column operators :::"
+  Q.vertical_columns = cols
+  return cols
+
+
 def extrude(f, b, d, ff, Q):
   r"""
   This extrudes a function <f> defined along a boundary <b> out onto
@@ -687,7 +710,9 @@ def extrude(f, b, d, ff, Q):
   
   u|_b = f
 
-  and solving.  
+  and solving.  On layered meshes extruded vertically, the value of <f> at
+  the surface (<b> = 2) or the base (<b> = 3 or 5) of each column is copied
+  to the column instead.
   
   :param f  : Dolfin function defined along a boundary
   :param b  : Boundary condition
@@ -695,6 +720,16 @@ def extrude(f, b, d, ff, Q):
   :param ff : Subdomain FacetFunction 
   :param Q  : FunctionSpace of domain
   """
+  cols = get_columns(Q)
+  if cols is not None and d == 2 and b in (2, 3, 5):
+    f_v       = interpolate(f, Q).vector().array()
+    v_v       = p.empty(Q.dim())
+    v_v[cols] = f_v[cols[:, -1 if b == 2 else 0]][:, p.newaxis]
+    v         = Function(Q)
+    v.vector().set_local(v_v)
+    v.vector().apply('insert')
+    return v
+  
   # define test and trial based on function space :
   phi = TestFunction(Q)
   v   = TrialFunction(Q)
@@ -716,4 +751,161 @@ def print_min_max(u, title):
   print title + ' <min, max> : <%f, %f>' % (uMin, uMax)
 
 
+class Timers(object):
+  """
+  Registry of named wall-clock timers and counters.  Time a block with
+  
+    with timers.time('velocity'):
+      ...
+  
+  or wrap a function with timers.timed(), and add to a counter, such as the
+  number of Newton iterations, with timers.count().  The module-level 
+  instance <timers> is shared by the physics and solvers.
+
+  The Krylov iterations of the velocity Newton solves are counted by 
+  newton_solve().  The other solves of the physics, the vertical velocity, 
+  enthalpy, age and adjoint solves, use direct (LU) solvers, which have no
+  Krylov iterations to report; they are only timed.
+  """
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    """
+    Clear all the timers and counters.
+    """
+    self.times  = {}   # total seconds spent in each timer
+    self.calls  = {}   # number of times each timer was entered
+    self.counts = {}   # total of each counter
+
+  @contextmanager
+  def time(self, name):
+    """
+    Context manager adding the time spent in its block to timer <name>.
+    """
+    tic = time()
+    try:
+      yield
+    finally:
+      self.times[name] = self.times.get(name, 0.0) + time() - tic
+      self.calls[name] = self.calls.get(name, 0) + 1
+
+  def timed(self, name, f):
+    """
+    Returns function <f> wrapped so that each call is added to timer <name>.
+    """
+    def g(*args, **kwargs):
+      with self.time(name):
+        return f(*args, **kwargs)
+    g.__name__ = f.__name__
+    g.__doc__  = f.__doc__
+    return g
+
+  def count(self, name, n=1):
+    """
+    Add <n> to counter <name>.
+    """
+    self.counts[name] = self.counts.get(name, 0) + n
+
+  def summary(self):
+    """
+    Returns a dict of the timers and counters, each reduced over the MPI 
+    processes to its min, avg and max.  This is collective, and all 
+    processes must have entered the same timers and counters.
+    """
+    comm = mpi_comm_world()
+    size = MPI.size(comm)
+    def stats(v):
+      v = float(v)
+      return {'min' : MPI.min(comm, v),
+              'avg' : MPI.sum(comm, v) / size,
+              'max' : MPI.max(comm, v)}
+    
+    s = {'processes' : size, 'timers' : {}, 'counters' : {}}
+    for name in sorted(self.times):
+      s['timers'][name]          = stats(self.times[name])
+      s['timers'][name]['calls'] = self.calls[name]
+    for name in sorted(self.counts):
+      s['counters'][name] = stats(self.counts[name])
+    return s
+
+  def report(self):
+    """
+    Print the summary of the timers and counters on the first process.
+    """
+    s = self.summary()
+    if MPI.rank(mpi_comm_world()) != 0:
+      return
+    print "::: timers over %i processes (min, avg, max seconds) :::" \
+          % s['processes']
+    for name, v in sorted(s['timers'].items()):
+      print '%-30s %8i calls  %10.3f %10.3f %10.3f' \
+            % (name, v['calls'], v['min'], v['avg'], v['max'])
+    for name, v in sorted(s['counters'].items()):
+      print '%-30s %12g %12g %12g' % (name, v['min'], v['avg'], v['max'])
+
+  def dump(self, filename):
+    """
+    Write the summary of the timers and counters to JSON file <filename> 
+    from the first process.
+    """
+    s = self.summary()
+    if MPI.rank(mpi_comm_world()) == 0:
+      with open(filename, 'w') as f:
+        json.dump(s, f, indent=2, sort_keys=True)
+      print "::: timers written to %s :::" % filename
+
+
+timers = Timers()
 
+
+class NewtonProblem(NonlinearProblem):
+  """
+  Nonlinear problem with residual <L>, Jacobian <a> and Dirichlet 
+  conditions <bcs> for a NewtonSolver, used by newton_solve() in place of a 
+  NonlinearVariationalProblem so that the solver, and its Krylov iteration
+  count, may be accessed.
+  """
+  def __init__(self, L, a, bcs):
+    NonlinearProblem.__init__(self)
+    self.L   = L
+    self.a   = a
+    self.bcs = bcs
+
+  def F(self, b, x):
+    assemble(self.L, tensor=b)
+    for bc in self.bcs:
+      bc.apply(b, x)
+
+  def J(self, A, x):
+    assemble(self.a, tensor=A)
+    for bc in self.bcs:
+      bc.apply(A)
+
+
+def newton_solve(name, F, U, J, bcs, params):
+  """
+  Solve the nonlinear problem with residual <F> and Jacobian <J> for 
+  Function <U> with Dirichlet conditions <bcs> by Newton's method, with the
+  'newton_solver' parameters of the NonlinearVariationalSolver parameters 
+  <params>.  The time spent is added to timer '<name> newton' of <timers>, 
+  and the Newton iterations, Krylov iterations and local dofs to counters 
+  '<name> newton iterations', '<name> krylov iterations' and '<name> dofs'.
+  A direct (LU) linear solver has no Krylov iterations, and adds none.
+
+  :rtype: the number of Newton iterations and whether they converged
+  """
+  solver = NewtonSolver()
+  solver.parameters.update(params['newton_solver'])
+  method = solver.parameters['linear_solver']
+  
+  for bc in bcs:
+    bc.apply(U.vector())
+  
+  with timers.time(name + ' newton'):
+    its, converged = solver.solve(NewtonProblem(F, J, bcs), U.vector())
+  timers.count(name + ' newton iterations', its)
+  timers.count(name + ' dofs', U.vector().local_size())
+  if method != 'default' and method in krylov_solver_methods():
+    timers.count(name + ' krylov iterations', solver.krylov_iterations())
+  return its, converged
@@ -1,5 +1,9 @@
 from fenics import *
 import numpy as np
+import hashlib
+import json
+import os
+from helper import get_columns
 
 class Model(object):
   """ 
@@ -9,9 +13,77 @@ class Model(object):
   types.
   """
 
+  # the function space of each field of the physics, allocated on first
+  # access by __getattr__ :
+  fields = {
+    # velocity model :
+    'U'         : 'Q2',
+    'u'         : 'Q',
+    'v'         : 'Q',
+    'w'         : 'Q',
+    'beta2'     : 'Q',
+    'mhat'      : 'Q',
+    'b'         : 'Q',
+    'epsdot'    : 'Q',
+    'E'         : 'Q',
+    'eta'       : 'Q',
+    'P'         : 'Q',
+    'Tstar'     : 'Q',
+    'W'         : 'Q',
+    'Vd'        : 'Q',
+    'Pe'        : 'Q',
+    'Sl'        : 'Q',
+    'Pc'        : 'Q',
+    'Nc'        : 'Q',
+    'Pb'        : 'Q',
+    'Lsq'       : 'Q',
+    # enthalpy model :
+    'H_surface' : 'Q',
+    'H'         : 'Q',
+    'T'         : 'Q',
+    'Mb'        : 'Q',
+    'q_geo'     : 'Q',
+    'cold'      : 'Q',
+    'Hhat'      : 'Q',
+    'uhat'      : 'Q',
+    'vhat'      : 'Q',
+    'what'      : 'Q',
+    'H0'        : 'Q',
+    'T0'        : 'Q',
+    'h_i'       : 'Q',
+    'kappa'     : 'Q',
+    # free surface model :
+    'dSdt'      : 'Q_flat',
+    'ahat'      : 'Q_flat',
+    'uhat_f'    : 'Q_flat',
+    'vhat_f'    : 'Q_flat',
+    'what_f'    : 'Q_flat',
+    'M'         : 'Q_flat',
+    # age model :
+    'age'       : 'Q',
+    'a0'        : 'Q',
+    # surface climate model :
+    'smb'       : 'Q',
+    'precip'    : 'Q',
+    'T_surface' : 'Q',
+    # adjoint model :
+    'u_o'       : 'Q',
+    'v_o'       : 'Q',
+    'U_o'       : 'Q',
+    'lam'       : 'Q',
+    'adot'      : 'Q',
+    # balance velocity model :
+    'dSdx'      : 'Q_flat',
+    'dSdy'      : 'Q_flat',
+    'Ub'        : 'Q_flat',
+    'u_balance' : 'Q',
+    'v_balance' : 'Q'
+  }
+
   def __init__(self, out_dir='./'):
     self.per_func_space = False  # function space is undefined
     self.out_dir        = out_dir
+    self.operators      = {}     # factorized column operators
 
   def set_geometry(self, sur, bed, deform=True, mask=None):
     """
@@ -102,15 +174,33 @@ class Model(object):
 
   def deform_mesh_to_geometry(self):
     """
-    Deforms the mesh to the geometry.
+    Deforms the mesh to the geometry.  The surface and bed are evaluated at
+    all of the vertices of the mesh local to this process at once, so that
+    distributed meshes are deformed in parallel.
     """
     print "::: deforming mesh to geometry :::"
+    
+    S = self.eval_at_vertices(self.S_ex)
+    B = self.eval_at_vertices(self.B_ex)
 
     # transform z :
     # thickness = surface - base, z = thickness + base
-    for x in self.mesh.coordinates():
-      x[2] = x[2] * ( self.S_ex(x[0],x[1],x[2]) - self.B_ex(x[0],x[1],x[2]) )
-      x[2] = x[2] + self.B_ex(x[0], x[1], x[2])
+    x      = self.mesh.coordinates()
+    x[:,2] = x[:,2] * (S - B) + B
+
+  def eval_at_vertices(self, ex):
+    """
+    Returns an array of the values of Expression <ex> at the vertices of the
+    mesh, in the order of self.mesh.coordinates().  Expressions with a 
+    batched eval_points(x, y) method, as those of DataInput, are evaluated 
+    with one call; any other is interpolated onto a continuous linear space,
+    evaluating every vertex in one compiled loop.
+    """
+    x = self.mesh.coordinates()
+    if hasattr(ex, 'eval_points'):
+      return np.asarray(ex.eval_points(x[:,0], x[:,1]), dtype=float)
+    Q = FunctionSpace(self.mesh, "CG", 1)
+    return interpolate(ex, Q).compute_vertex_values(self.mesh)
 
   def calculate_boundaries(self):
     """
@@ -124,90 +214,87 @@ class Model(object):
     self.ff      = FacetFunction('size_t', self.mesh,      0)
     self.ff_flat = FacetFunction('size_t', self.flat_mesh, 0)
     
-    # iterate through the facets and mark each if on a boundary :
-    #
-    #   2 = high slope, upward facing ................ surface
-    #   3 = high slope, downward facing .............. base
-    #   4 = low slope, upward or downward facing ..... sides
-    #   5 = floating ................................. base
-    #   6 = floating ................................. sides
+    # mark each exterior facet of both meshes, with the mask sampled at the
+    # midpoints of the facets of each mesh :
+    self.mark_facets(self.mesh,      self.ff,      mask)
+    self.mark_facets(self.flat_mesh, self.ff_flat, mask)
+    
+    self.ds      = Measure('ds')[self.ff]
+    self.ds_flat = Measure('ds')[self.ff_flat]
+
+  def mark_facets(self, mesh, ff, mask=None, tol=1e-3):
+    """
+    Marks each exterior facet of <mesh> in FacetFunction <ff> :
+    
+      2 = high slope, upward facing ................ surface
+      3 = high slope, downward facing .............. base
+      4 = low slope, upward or downward facing ..... sides
+      5 = floating ................................. base
+      6 = floating ................................. sides
+    
+    where a facet is floating if Expression <mask> is positive at its 
+    midpoint, and high slope if the z component of its unit normal is 
+    at least <tol> in magnitude.
+    """
+    idx, n_z, x_m, y_m = self.exterior_facets(mesh)
+    
+    up    = n_z >=  tol
+    down  = n_z <= -tol
+    marks = np.where(up, 2, np.where(down, 3, 4))
+    
     if mask != None:
-      for f in facets(self.mesh):
-        n       = f.normal()    # unit normal vector to facet f
-        tol     = 1e-3
-        x_m     = f.midpoint().x()
-        y_m     = f.midpoint().y()
-        mask_xy = mask(x_m, y_m)
-      
-        if   n.z() >=  tol and f.exterior():
-          self.ff[f] = 2
-      
-        elif n.z() <= -tol and f.exterior():
-          if mask_xy > 0:
-            self.ff[f] = 5
-          else:
-            self.ff[f] = 3
-      
-        elif n.z() >  -tol and n.z() < tol and f.exterior():
-          if mask_xy > 0:
-            self.ff[f] = 6
-          else:
-            self.ff[f] = 4
-      
-      for f in facets(self.flat_mesh):
-        n       = f.normal()    # unit normal vector to facet f
-        tol     = 1e-3
-        mask_xy = mask(x_m, y_m)
-      
-        if   n.z() >=  tol and f.exterior():
-          self.ff_flat[f] = 2
-      
-        elif n.z() <= -tol and f.exterior():
-          if mask_xy > 0:
-            self.ff_flat[f] = 5
-          else:
-            self.ff_flat[f] = 3
-      
-        elif n.z() >  -tol and n.z() < tol and f.exterior():
-          if mask_xy > 0:
-            self.ff_flat[f] = 6
-          else:
-            self.ff_flat[f] = 4
+      sel           = np.flatnonzero(~up)
+      floating      = np.zeros(len(idx), dtype=bool)
+      floating[sel] = self.eval_at_points(mask, x_m[sel], y_m[sel]) > 0
+      side          = ~(up | down)
+      marks[down & floating] = 5
+      marks[side & floating] = 6
+    
+    ff.array()[idx] = marks
 
-    # iterate through the facets and mark each if on a boundary :
-    #
-    #   2 = high slope, upward facing ................ surface
-    #   3 = high slope, downward facing .............. base
-    #   4 = low slope, upward or downward facing ..... sides
-    else:
-      for f in facets(self.mesh):
-        n       = f.normal()    # unit normal vector to facet f
-        tol     = 1e-3
-      
-        if   n.z() >=  tol and f.exterior():
-          self.ff[f] = 2
-      
-        elif n.z() <= -tol and f.exterior():
-          self.ff[f] = 3
-      
-        elif n.z() >  -tol and n.z() < tol and f.exterior():
-          self.ff[f] = 4
+  def exterior_facets(self, mesh):
+    """
+    Returns the indices of the exterior facets of tetrahedral mesh <mesh>, 
+    the z component of their outward unit normals, and the x and y 
+    coordinates of their midpoints, all computed as arrays from the 
+    connectivity of the mesh.  Facets shared with another process are not 
+    exterior.
+    """
+    mesh.init(2, 0)
+    mesh.init(3, 2)
+    x  = mesh.coordinates()
+    fv = np.asarray(mesh.topology()(2, 0)()).reshape((-1, 3))
+    cf = np.asarray(mesh.topology()(3, 2)()).reshape((-1, 4))
     
-      for f in facets(self.flat_mesh):
-        n       = f.normal()    # unit normal vector to facet f
-        tol     = 1e-3
-      
-        if   n.z() >=  tol and f.exterior():
-          self.ff_flat[f] = 2
-      
-        elif n.z() <= -tol and f.exterior():
-          self.ff_flat[f] = 3
-      
-        elif n.z() >  -tol and n.z() < tol and f.exterior():
-          self.ff_flat[f] = 4
+    # facets of a single cell :
+    ext    = np.bincount(cf.ravel(), minlength=len(fv)) == 1
+    shared = mesh.topology().shared_entities(2)
+    if len(shared) > 0:
+      ext[np.array(list(shared.keys()))] = False
     
-    self.ds      = Measure('ds')[self.ff]
-    self.ds_flat = Measure('ds')[self.ff_flat]
+    # the cell of each exterior facet, and the vertex of it opposite the 
+    # facet, which gives the outward direction :
+    cell, loc = np.nonzero(ext[cf])
+    idx       = cf[cell, loc]
+    v         = fv[idx]
+    opp       = mesh.cells()[cell].sum(axis=1) - v.sum(axis=1)
+    
+    a, b, c = x[v[:,0]], x[v[:,1]], x[v[:,2]]
+    n       = np.cross(b - a, c - a)
+    sign    = np.sign(np.sum(n * (a - x[opp]), axis=1))
+    n_z     = sign * n[:,2] / np.sqrt(np.sum(n**2, axis=1))
+    mid     = (a + b + c) / 3.0
+    return idx, n_z, mid[:,0], mid[:,1]
+
+  def eval_at_points(self, ex, x, y):
+    """
+    Returns an array of the values of Expression <ex> at the points with
+    coordinates <x> and <y>, with one call for the expressions of DataInput,
+    which have a batched eval_points(x, y) method.
+    """
+    if hasattr(ex, 'eval_points'):
+      return np.asarray(ex.eval_points(x, y), dtype=float)
+    return np.array([ex(xi, yi) for xi, yi in zip(x, y)], dtype=float)
      
   def set_parameters(self, params):
     """
@@ -308,6 +395,60 @@ class Model(object):
                           [epsdot[2,0],  epsdot[2,1],  epsdot[2,2]]])
     return eta * epsdot
      
+  def get_columns(self, Q):
+    """
+    Returns an array of the indices of the degrees of freedom of scalar 
+    FunctionSpace <Q> in each vertical column of the mesh, one row per 
+    column ordered from the bed to the surface, or None if the mesh is not 
+    layered; see helper.get_columns.
+    """
+    return get_columns(Q)
+
+  def dof_values(self, f, Q):
+    """
+    Returns an array of the values of <f> at the degrees of freedom of 
+    FunctionSpace <Q>.  Functions in <Q> are read directly, other 
+    functions and expressions are interpolated, and UFL forms are 
+    projected with a lumped mass matrix.
+    """
+    if isinstance(f, Function) and f.function_space() == Q:
+      return f.vector().array()
+    if isinstance(f, (Function, Expression, Constant)):
+      return interpolate(f, Q).vector().array()
+    phi = TestFunction(Q)
+    return assemble(f * phi * dx).array() / assemble(phi * dx).array()
+
+  def column_function(self, Q, values):
+    """
+    Returns a Function in FunctionSpace <Q> with the dof values <values>.
+    """
+    v = Function(Q)
+    v.vector().set_local(values)
+    v.vector().apply('insert')
+    return v
+
+  def get_operator(self, key, refs, a, bcs):
+    """
+    Returns an LUSolver for the bilinear form <a> with the Dirichlet 
+    conditions <bcs> applied, assembled and factorized once for each <key> 
+    and reused until the coordinates of the mesh change, as when the mesh is
+    moved by the free-surface solver.  The objects <refs> whose ids are in
+    <key> are kept, so that the ids are not reused.
+    """
+    x     = refs[0].mesh().coordinates()
+    stamp = hashlib.sha1(np.ascontiguousarray(x).tostring()).hexdigest()
+    if key in self.operators and self.operators[key][1] == stamp:
+      return self.operators[key][2]
+    
+    print "::: factorizing %s operator :::" % key[0]
+    A = assemble(a)
+    for bc in bcs:
+      bc.apply(A)
+    solver = LUSolver(A)
+    solver.parameters['reuse_factorization'] = True
+    self.operators[key] = (refs, stamp, solver, A)
+    return solver
+
   def extrude(self, f, b, d, Q='self'):
     r"""
     This extrudes a function <f> defined along a boundary <b> out onto
@@ -320,7 +461,10 @@ class Model(object):
     
     u|_b = f
   
-    and solving.  
+    and solving, with the factorization of the operator reused between calls.
+    On layered meshes extruded vertically, the value of <f> at the surface 
+    (<b> = 2) or the base (<b> = 3 or 5) of each column is copied to the 
+    column instead.
     
     :param f  : Dolfin function defined along a boundary
     :param b  : Boundary condition
@@ -328,30 +472,61 @@ class Model(object):
     """
     if type(Q) != FunctionSpace:
       Q = self.Q
-    ff  = self.ff
-    phi = TestFunction(Q)
-    v   = TrialFunction(Q)
-    a   = v.dx(d) * phi * dx
-    L   = DOLFIN_EPS * phi * dx  # really close to zero to fool FFC
-    bc  = DirichletBC(Q, f, ff, b)
-    v   = Function(Q)
-    solve(a == L, v, bc)
+    
+    cols = self.get_columns(Q)
+    if cols is not None and d == 2 and b in (2, 3, 5):
+      f_v       = self.dof_values(f, Q)
+      v_v       = np.empty(Q.dim())
+      v_v[cols] = f_v[cols[:, -1 if b == 2 else 0]][:, np.newaxis]
+      return self.column_function(Q, v_v)
+    
+    ff     = self.ff
+    phi    = TestFunction(Q)
+    v      = TrialFunction(Q)
+    a      = v.dx(d) * phi * dx
+    L      = DOLFIN_EPS * phi * dx  # really close to zero to fool FFC
+    bc     = DirichletBC(Q, f, ff, b)
+    solver = self.get_operator(('extrude', id(Q), id(ff), b, d), (Q, ff), 
+                               a, [bc])
+    rhs    = assemble(L)
+    bc.apply(rhs)
+    v      = Function(Q)
+    solver.solve(v.vector(), rhs)
     return v
   
   def vert_integrate(self, u, Q='self'):
     """
-    Integrate <u> from the bed to the surface.
+    Integrate <u> from the bed to the surface.  On layered meshes this is
+    a cumulative trapezoidal sum up each column, otherwise the solution of
+    a variational problem whose factorized operator is reused between calls.
     """
     if type(Q) != FunctionSpace:
       Q = self.Q
+    
+    cols = self.get_columns(Q)
+    if cols is not None:
+      gdim            = Q.mesh().geometry().dim()
+      x               = Q.dofmap().tabulate_all_coordinates(Q.mesh())
+      z               = x.reshape((-1, gdim))[cols, 2]
+      u_c             = self.dof_values(u, Q)[cols]
+      dv              = 0.5 * (u_c[:,1:] + u_c[:,:-1]) * np.diff(z, axis=1)
+      v_v             = np.empty(Q.dim())
+      v_v[cols[:,0]]  = 0.0                 # integral is zero on bed 
+      v_v[cols[:,1:]] = np.cumsum(dv, axis=1)
+      return self.column_function(Q, v_v)
+    
     ff     = self.ff                       # facet function defines boundaries
     phi    = TestFunction(Q)               # test function
     v      = TrialFunction(Q)              # trial function
     bc     = DirichletBC(Q, 0.0, ff, 3)    # integral is zero on bed (ff = 3) 
     a      = v.dx(2) * phi * dx            # rhs
     L      = u * phi * dx                  # lhs
+    solver = self.get_operator(('vert_integrate', id(Q), id(ff)), (Q, ff), 
+                               a, [bc])
+    rhs    = assemble(L)
+    bc.apply(rhs)
     v      = Function(Q)                   # solution function
-    solve(a == L, v, bc)                   # solve
+    solver.solve(v.vector(), rhs)          # solve
     return v
 
   def rotate(self, M, theta):
@@ -763,76 +938,159 @@ class Model(object):
     self.x             = SpatialCoordinate(self.mesh)
     self.sigma         = project((self.x[2] - self.B) / (self.S - self.B))
 
-    # Velocity model
-    self.U             = Function(self.Q2)
-    self.u             = Function(self.Q)
-    self.v             = Function(self.Q)
-    self.w             = Function(self.Q)
-    self.beta2         = Function(self.Q)
-    self.mhat          = Function(self.Q)
-    self.b             = Function(self.Q)
-    self.epsdot        = Function(self.Q)
-    self.E             = Function(self.Q)
-    self.eta           = Function(self.Q)
-    self.P             = Function(self.Q)
-    self.Tstar         = Function(self.Q)
-    self.W             = Function(self.Q) 
-    self.Vd            = Function(self.Q) 
-    self.Pe            = Function(self.Q) 
-    self.Sl            = Function(self.Q) 
-    self.Pc            = Function(self.Q)
-    self.Nc            = Function(self.Q)
-    self.Pb            = Function(self.Q)
-    self.Lsq           = Function(self.Q)
-    
-    # Enthalpy model
-    self.H_surface     = Function(self.Q)
-    self.H             = Function(self.Q)
-    self.T             = Function(self.Q)
-    self.W             = Function(self.Q)
-    self.Mb            = Function(self.Q)
-    self.q_geo         = Function(self.Q)
-    self.cold          = Function(self.Q)
-    self.Hhat          = Function(self.Q) # Midpoint values, usually set to H_n
-    self.uhat          = Function(self.Q) # Midpoint values, usually set to H_n
-    self.vhat          = Function(self.Q) # Midpoint values, usually set to H_n
-    self.what          = Function(self.Q) # Midpoint values, usually set to H_n
-    self.mhat          = Function(self.Q) # ALE is required: we change the mesh 
-    self.H0            = Function(self.Q) # None initial enthalpy
-    self.T0            = Function(self.Q) # None
-    self.h_i           = Function(self.Q) # None
-    self.kappa         = Function(self.Q) # None
+    # the fields of the physics are allocated on first access, replacing 
+    # any parameter of the same name (E, a0, q_geo) as before :
+    for name in Model.fields:
+      self.__dict__.pop(name, None)
 
-    # free surface model :
-    self.dSdt          = Function(self.Q_flat)
-    self.ahat          = Function(self.Q_flat)
-    self.uhat_f        = Function(self.Q_flat)
-    self.vhat_f        = Function(self.Q_flat)
-    self.what_f        = Function(self.Q_flat)
-    self.M             = Function(self.Q_flat)
-    
-    # Age model   
-    self.age           = Function(self.Q)
-    self.a0            = Function(self.Q)
-
-    # Surface climate model
-    self.smb           = Function(self.Q)
-    self.precip        = Function(self.Q)
-    self.T_surface     = Function(self.Q)
-
-    # Adjoint model
-    self.u_o           = Function(self.Q)
-    self.v_o           = Function(self.Q)
-    self.U_o           = Function(self.Q)
-    self.lam           = Function(self.Q)
-    self.adot          = Function(self.Q)
-
-    # Balance Velocity model :
-    self.dSdx          = Function(self.Q_flat)
-    self.dSdy          = Function(self.Q_flat)
-    self.Ub            = Function(self.Q_flat)
-    self.u_balance     = Function(self.Q)
-    self.v_balance     = Function(self.Q)
+  def __getattr__(self, name):
+    """
+    Allocates the field <name> of Model.fields in its function space on 
+    first access, so that memory is only taken by the fields used by the 
+    physics being solved.
+    """
+    if name in Model.fields and Model.fields[name] in self.__dict__:
+      f = Function(self.__dict__[Model.fields[name]])
+      self.__dict__[name] = f
+      return f
+    raise AttributeError("'%s' object has no attribute '%s'" 
+                         % (type(self).__name__, name))
 
+  def print_allocations(self):
+    """
+    Prints the name, function space, dimension, and size in MB of every 
+    Function of the model allocated so far, largest first, and returns 
+    the total size in bytes.
+    """
+    print "::: allocated model fields :::"
+    
+    sizes = []
+    for name, f in self.__dict__.items():
+      if isinstance(f, Function):
+        n = f.vector().size()
+        sizes.append((8*n, name, Model.fields.get(name, '-'), n))
+    sizes.sort(reverse=True)
+    
+    for b, name, space, n in sizes:
+      print "    %-12s %-7s %12i dofs %10.1f MB" % (name, space, n, b/1e6)
+    total = sum(b for b, name, space, n in sizes)
+    print "    %i fields, %.1f MB in total" % (len(sizes), total/1e6)
+    return total
 
+  def state_groups(self, f):
+    """
+    Returns the names of the states saved in the open HDF5File <f>, the 
+    single state 'state' or the time snapshots in the order written.
+    """
+    if f.has_dataset('state/mesh'):
+      return ['state']
+    groups = []
+    while f.has_dataset('snapshot_%i/mesh' % len(groups)):
+      groups.append('snapshot_%i' % len(groups))
+    return groups
 
+  def save_state(self, filename, config=None, t=None):
+    """
+    Saves the state of the model to the HDF5 file <filename> : the mesh and
+    flat mesh with their facet markers, every allocated Function in the 
+    spaces of the model, and the solver configuration dictionary <config>, 
+    with anything that is not a number, string, list, or dictionary stored 
+    by its repr.  If the time <t> is given the state is appended to the file
+    as the next snapshot, otherwise the file holds this state only.  Every
+    process writes its part of the mesh and fields in parallel.
+    """
+    spaces = ['Q', 'Q_flat', 'Q2', 'Q4', 'Q_non_periodic', 
+              'Q_flat_non_periodic']
+    spaces = [n for n in spaces if n in self.__dict__]
+    names  = []
+    for name, f in sorted(self.__dict__.items()):
+      if isinstance(f, Function):
+        for space in spaces:
+          if f.function_space() == self.__dict__[space]:
+            names.append((name, space))
+            break
+    
+    if t != None and os.path.isfile(filename):
+      f     = HDF5File(self.mesh.mpi_comm(), filename, 'a')
+      group = 'snapshot_%i' % len(self.state_groups(f))
+    else:
+      f     = HDF5File(self.mesh.mpi_comm(), filename, 'w')
+      group = 'state' if t == None else 'snapshot_0'
+    
+    print "::: saving %i fields to %s/%s :::" % (len(names), filename, group)
+    f.write(self.mesh,      group + '/mesh')
+    f.write(self.ff,        group + '/ff')
+    f.write(self.flat_mesh, group + '/flat_mesh')
+    f.write(self.ff_flat,   group + '/ff_flat')
+    for name, space in names:
+      f.write(self.__dict__[name], group + '/' + name)
+    
+    attr           = f.attributes(group + '/mesh')
+    attr['fields'] = ' '.join('%s:%s' % n for n in names)
+    attr['config'] = json.dumps(config, default=repr)
+    if t != None:
+      attr['t']    = float(t)
+    f.close()
+
+  def load_state(self, filename, group=None):
+    """
+    Restores the model from the state <group> of the HDF5 file <filename> 
+    written by save_state, by default the last snapshot : the meshes, facet
+    markers, function spaces, and fields, in place of set_mesh, set_geometry
+    and initialize_variables.  The parameters must have been set, and the 
+    function spaces are restored without periodic constraints.  Returns 
+    the solver configuration dictionary saved with the state, with the 
+    entries that are not numbers, strings, lists, or dictionaries as their 
+    reprs.
+    """
+    f = HDF5File(mpi_comm_world(), filename, 'r')
+    if group == None:
+      group = self.state_groups(f)[-1]
+    print "::: loading %s/%s :::" % (filename, group)
+    
+    self.mesh      = Mesh()
+    self.flat_mesh = Mesh()
+    f.read(self.mesh,      group + '/mesh',      False)
+    f.read(self.flat_mesh, group + '/flat_mesh', False)
+    self.ff        = FacetFunction('size_t', self.mesh)
+    self.ff_flat   = FacetFunction('size_t', self.flat_mesh)
+    f.read(self.ff,      group + '/ff')
+    f.read(self.ff_flat, group + '/ff_flat')
+    self.ds        = Measure('ds')[self.ff]
+    self.ds_flat   = Measure('ds')[self.ff_flat]
+    
+    self.params.globalize_parameters(self)
+    self.Q         = FunctionSpace(self.mesh,      "CG", 1)
+    self.Q_flat    = FunctionSpace(self.flat_mesh, "CG", 1)
+    self.Q2        = MixedFunctionSpace([self.Q]*2)
+    self.Q4        = MixedFunctionSpace([self.Q]*4)
+    self.operators = {}
+    for name in Model.fields:
+      self.__dict__.pop(name, None)
+    
+    attr = f.attributes(group + '/mesh')
+    for n in attr['fields'].split():
+      name, space         = n.split(':')
+      space               = space.replace('_non_periodic', '')
+      self.__dict__[name] = Function(self.__dict__[space])
+      f.read(self.__dict__[name], group + '/' + name)
+    config = json.loads(attr['config'])
+    f.close()
+    
+    self.x     = SpatialCoordinate(self.mesh)
+    self.sigma = project((self.x[2] - self.B) / (self.S - self.B))
+    return config
+
+  def read_fields(self, filename, names, group=None):
+    """
+    Reads the fields with names in the list <names> of the state <group> of
+    the HDF5 file <filename> written by save_state, by default the last 
+    snapshot, into the fields of this model, which must be on the same mesh,
+    though it may be distributed differently.
+    """
+    f = HDF5File(mpi_comm_world(), filename, 'r')
+    if group == None:
+      group = self.state_groups(f)[-1]
+    for name in names:
+      f.read(getattr(self, name), group + '/' + name)
+    f.close()
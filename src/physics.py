@@ -28,10 +28,13 @@ based on lapse rates
 
 from pylab  import ndarray
 from fenics import *
-from helper import print_min_max
+from helper import print_min_max, timers, newton_solve
 import numpy as np
 import numpy.linalg as linalg
 
+# time every projection, also those of the solvers :
+project = timers.timed('project', project)
+
 
 class VelocityStokes(object):
   r"""  
@@ -182,7 +185,7 @@ class VelocityStokes(object):
       beta2.vector().set_local(config['velocity']['beta2'])
       beta2.vector().apply('insert')
     
-    elif isinstance(config['velocity']['beta2'], Expression):
+    elif isinstance(config['velocity']['beta2'], (Expression, Function)):
       beta2.interpolate(config['velocity']['beta2'])
    
     # initialize enhancement factor :
@@ -193,7 +196,7 @@ class VelocityStokes(object):
       E.vector().set_local(config['velocity']['E'])
       E.vector().apply('insert')
     
-    elif isinstance(config['velocity']['E'], Expression):
+    elif isinstance(config['velocity']['E'], (Expression, Function)):
       E.interpolate(config['velocity']['E'])
 
     # pressure boundary :
@@ -338,8 +341,8 @@ class VelocityStokes(object):
        
     # Solve the nonlinear equations via Newton's method
     print "::: solving full-stokes velocity :::"
-    solve(self.F == 0, model.U, bcs=self.bcs, J = self.J, 
-          solver_parameters = self.newton_params)
+    newton_solve('velocity', self.F, model.U, self.J, self.bcs, 
+                 self.newton_params)
     
     model.u = project(model.U[0])
     model.v = project(model.U[1])
@@ -521,7 +524,7 @@ class VelocityBP(object):
         T.vector().set_local(config['velocity']['T0'])
         T.vector().apply('insert')
       
-      elif isinstance(config['velocity']['T0'], Expression):
+      elif isinstance(config['velocity']['T0'], (Expression, Function)):
         T.interpolate(config['velocity']['T0'])
 
     # initialize the bed friction coefficient :
@@ -532,7 +535,7 @@ class VelocityBP(object):
       beta2.vector().set_local(config['velocity']['beta2'])
       beta2.vector().apply('insert')
     
-    elif isinstance(config['velocity']['beta2'], Expression):
+    elif isinstance(config['velocity']['beta2'], (Expression, Function)):
       beta2.interpolate(config['velocity']['beta2'])
    
     # initialize the enhancement factor :
@@ -543,7 +546,7 @@ class VelocityBP(object):
       E.vector().set_local(config['velocity']['E'])
       E.vector().apply('insert')
     
-    elif isinstance(config['velocity']['E'], Expression):
+    elif isinstance(config['velocity']['E'], (Expression, Function)):
       E.interpolate(config['velocity']['E'])
 
     # Check if there are non-linear solver parameters defined.  If not, set 
@@ -656,11 +659,11 @@ class VelocityBP(object):
     
     # solve nonlinear system :
     print "::: solving BP velocity :::"
-    solve(self.F == 0, model.U, J = self.J,
-          solver_parameters = self.newton_params)
+    newton_solve('velocity', self.F, model.U, self.J, [], self.newton_params)
 
     # solve for vertical velocity :
-    solve(self.aw == self.Lw, model.w)
+    with timers.time('vertical velocity'):
+      solve(self.aw == self.Lw, model.w)
     
     model.u = project(model.U[0], model.Q)
     model.v = project(model.U[1], model.Q)
@@ -849,7 +852,7 @@ class Enthalpy(object):
         model.T_surface.vector().set_local(T_surface)
         model.T_surface.vector().apply('insert')
       
-      elif isinstance(T_surface, Expression):
+      elif isinstance(T_surface, (Expression, Function)):
         model.T_surface.interpolate(T_surface)
 
     # initialize basal heat term :
@@ -860,7 +863,7 @@ class Enthalpy(object):
       model.q_geo.vector().set_local(q_geo)
       model.q_geo.vector().apply('insert')
     
-    elif isinstance(q_geo, Expression):
+    elif isinstance(q_geo, (Expression, Function)):
       model.q_geo.interpolate(q_geo) 
     
     q_geo     = model.q_geo
@@ -922,7 +925,9 @@ class Enthalpy(object):
 
     # configure the module to run in transient mode :
     elif config['mode'] == 'transient':
-      dt = config['time_step']
+      # the time step is a Constant so the solver can adapt it :
+      dt      = Constant(config['time_step'])
+      self.dt = dt
     
       # Skewed test function.  Note that vertical velocity has 
       # the mesh velocity subtracted from it.
@@ -1087,6 +1092,25 @@ class Enthalpy(object):
           solver_parameters = {"linear_solver": "lu"})
   
     print_min_max(model.H, 'H')
+    
+    self.update_temperature()
+
+  def update_temperature(self):
+    """
+    Set the temperature, water content and basal melt rate from the current
+    enthalpy model.H, holding the temperature at or below the pressure-
+    melting point and the water content positive.
+    """
+    model = self.model
+    T0    = model.T0
+    Q     = model.Q
+    H     = model.H
+    C     = model.C
+    h_i   = model.h_i
+    T     = model.T
+    W     = model.W
+    Mb    = self.Mb
+    L     = model.L
 
     # Convert enthalpy values to temperatures and water contents
     T0_n  = project(T0,  Q)
@@ -1157,6 +1181,13 @@ class FreeSurface(object):
   |   \mathcal{R}                     |surface equation                   |
   +-----------------------------------+-----------------------------------+
 
+  With config['free_surface']['time_scheme'] set to 'backward_euler' or 
+  'crank_nicolson', the surface is advanced over the time step self.dt by
+  the linearized implicit form of the same equation, with the velocity, 
+  the accumulation and the shock-capturing coefficient held at the current
+  surface, and the rate of change is then (S_{n+1} - S_n) / dt.  The 
+  default 'explicit' returns the rate of change of the current surface.
+
   For the Stokes' equations to remain stable, it is necessary to either
   satisfy or circumvent the Ladyzehnskaya-Babuska-Brezzi (LBB) condition.
   We circumvent this condition by using a Galerkin-least squares (GLS)
@@ -1238,6 +1269,29 @@ class FreeSurface(object):
     C                = 10.0*h/(2*unorm) * term1 * term2**2
     diffusion_matrix = C * dot(grad(phi), grad(self.Shat)) * dSurf
     
+    # linearized implicit step of the surface, the trial function being the
+    # surface at the end of the step :
+    self.scheme = config['free_surface'].get('time_scheme', 'explicit')
+    if self.scheme != 'explicit':
+      if   self.scheme == 'backward_euler':
+        theta = 1.0
+      elif self.scheme == 'crank_nicolson':
+        theta = 0.5
+      else:
+        raise ValueError('unknown free-surface time scheme %s' % self.scheme)
+      self.dt   = Constant(config['time_step'])
+      S_mid     = theta*dS + (1 - theta)*self.Shat
+      implicit  = + (dS - self.Shat) / self.dt * phihat * dSurf \
+                  + self.uhat * S_mid.dx(0) * phihat * dSurf \
+                  + self.vhat * S_mid.dx(1) * phihat * dSurf \
+                  - (self.what + self.ahat) * phihat * dSurf
+      if config['free_surface']['use_shock_capturing']:
+        implicit += C * dot(grad(phi), grad(S_mid)) * dSurf
+      self.a_implicit = lhs(implicit)
+      self.L_implicit = rhs(implicit)
+      self.S_boundary = DirichletBC(Q_flat, self.Shat, model.ff_flat, 4)
+      self.S_new      = Function(Q_flat)
+    
     # Set up the Galerkin-least squares formulation of the Stokes' functional
     A_pro         = - phi.dx(2)*dS*dx - dS*phi*dBase + dSdt*phi*dSurf 
     M.vector()[:] = 1.0
@@ -1273,6 +1327,48 @@ class FreeSurface(object):
     self.Shat.vector().apply('insert') 
     self.ahat.vector().apply('insert') 
 
+    if self.scheme != 'explicit':
+      self.solve_implicit()
+    else:
+      self.solve_explicit()
+
+    A = assemble(lhs(self.A_pro))
+    p = assemble(rhs(self.A_pro))
+    q = Vector()  
+    solve(A, q,p)
+    model.dSdt.vector()[:] = q
+
+  def solve_implicit(self):
+    """
+    Advance the surface over the time step self.dt with one sparse linear 
+    solve, and set model.dSdt on the surface to the rate of change over the
+    step.
+    """
+    model  = self.model
+    config = self.config
+    
+    print "::: solving free-surface (%s) :::" % self.scheme
+    A = assemble(self.a_implicit, keep_diagonal=True)
+    b = assemble(self.L_implicit)
+    if config['free_surface']['static_boundary_conditions']:
+      self.S_boundary.apply(A, b)
+    A.ident_zeros()
+    solve(A, self.S_new.vector(), b)
+    
+    dSdt = model.dSdt.vector()
+    dSdt.zero()
+    dSdt.axpy( 1.0, self.S_new.vector())
+    dSdt.axpy(-1.0, self.Shat.vector())
+    dSdt *= 1.0 / float(self.dt)
+
+  def solve_explicit(self):
+    """
+    Set model.dSdt on the surface to the rate of change of the current 
+    surface.
+    """
+    model  = self.model
+    config = self.config
+
     m = assemble(self.mass_matrix,      keep_diagonal=True)
     r = assemble(self.stiffness_matrix, keep_diagonal=True)
 
@@ -1298,12 +1394,6 @@ class FreeSurface(object):
       m.ident_zeros()
       solve(m, model.dSdt.vector(), r)
 
-    A = assemble(lhs(self.A_pro))
-    p = assemble(rhs(self.A_pro))
-    q = Vector()  
-    solve(A, q,p)
-    model.dSdt.vector()[:] = q
-
 class AdjointVelocityBP(object):
   """ 
   Complete adjoint of the BP momentum balance.  Now updated to calculate
@@ -1424,7 +1514,9 @@ class AdjointVelocityBP(object):
     l = assemble(rhs(self.dI))
 
     print "::: solving adjoint BP velocity :::"
-    solve(A, self.model.Lam.vector(), l)
+    with timers.time('adjoint solve'):
+      solve(A, self.model.Lam.vector(), l)
+    timers.count('adjoint dofs', l.local_size())
     
 
 class SurfaceClimate(object):
@@ -1510,8 +1602,9 @@ class Age(object):
       what   = model.what
       mhat   = model.mhat
 
-      # Time step
-      dt     = config['time_step']
+      # Time step, a Constant so the solver can adapt it :
+      dt      = Constant(config['time_step'])
+      self.dt = dt
 
       # SUPG method (note subtraction of mesh velocity) :
       h      = CellSize(model.mesh)
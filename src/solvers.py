@@ -3,15 +3,73 @@ from fenics         import project, File, vertex_to_dof_map, Function, \
                            assemble, sqrt, DoubleArray, Constant, function
 from physics        import *
 from scipy.optimize import fmin_l_bfgs_b
-from helper         import print_min_max
+from helper         import print_min_max, timers
 from time           import time
 import numpy as np
 
+class AndersonAcceleration(object):
+  """
+  Anderson mixing for the fixed-point iteration x = G(x), which finds the 
+  next iterate from the last <m> iterates and their images under G, mixed 
+  with the damping parameter <beta> (1.0 is undamped).  The arrays are the 
+  parts local to this process; the least-squares problem for the mixing 
+  coefficients is formed with global inner products.
+  """
+  def __init__(self, m=5, beta=1.0):
+    self.m    = m
+    self.beta = beta
+    self.x    = []        # previous iterates
+    self.f    = []        # previous residuals G(x) - x
+
+  def update(self, x, g):
+    """
+    Returns the next iterate given the iterate <x> and its image <g> = G(x).
+    """
+    f = g - x
+    self.x.append(x.copy())
+    self.f.append(f)
+    if len(self.x) > self.m + 1:
+      self.x.pop(0)
+      self.f.pop(0)
+    
+    x_new = x + self.beta * f
+    n     = len(self.x) - 1
+    if n == 0:
+      return x_new
+    
+    # differences of the iterates and residuals :
+    dX  = [self.x[i+1] - self.x[i] for i in range(n)]
+    dF  = [self.f[i+1] - self.f[i] for i in range(n)]
+    
+    # normal equations of min || f - dF gamma ||, summed over processes :
+    A   = zeros((n, n))
+    b   = zeros(n)
+    for i in range(n):
+      b[i] = MPI.sum(mpi_comm_world(), float(np.dot(dF[i], f)))
+      for j in range(i, n):
+        A[i,j] = MPI.sum(mpi_comm_world(), float(np.dot(dF[i], dF[j])))
+        A[j,i] = A[i,j]
+    
+    # a small Tikhonov term guards against nearly dependent differences :
+    gamma = np.linalg.solve(A + 1e-10 * np.trace(A) * np.eye(n), b)
+    for i in range(n):
+      x_new -= gamma[i] * (dX[i] + self.beta * dF[i])
+    return x_new
+
+
 class SteadySolver(object):
   """
   This class solves for velocity, enthalpy (temperature), surface mass balance, 
   and ice age in steady state. The coupling between velocity and enthalpy 
-  is performed via a Picard iteration.
+  is performed via a Picard iteration, optionally accelerated by Anderson 
+  mixing of the enthalpy with config['coupled'] :
+  
+    'acceleration'   : None (plain Picard) or 'anderson'
+    'anderson_depth' : number of previous iterates mixed (default 5)
+    'anderson_beta'  : damping parameter of the mixing (default 1.0)
+    'inner_tol'      : tolerance of the max-norm of the velocity change
+    'rel_tol'        : tolerance of the change relative to the max-norm of 
+                       the velocity (default 0.0)
   
   :param model  : An instantiated 2D flowline ice :class:`~src.model.Model`
   :param config : Dictionary object containing information on physical 
@@ -56,77 +114,117 @@ class SteadySolver(object):
     enthalpy, surface mass balance, temperature boundary condition, and
     the age equation.  Turn off any solver by editing the appropriate config
     dict entry to "False".  If config['coupled']['on'] is "False", solve only
-    once.
+    once.  The norms of the velocity change of each iteration are kept in 
+    self.history as (iteration, absolute, relative) tuples.
     """
     model   = self.model
     config  = self.config
+    coupled = config['coupled']
     T0      = config['velocity']['T0']
     outpath = config['output_path']
     
     # Set the initial Picard iteration (PI) parameters
     # L_\infty norm in velocity between iterations
     inner_error = inf
+    rel_error   = inf
    
     # number of iterations
     counter     = 0
    
     # previous velocity for norm calculation
-    u_prev      = project(model.u, model.Q).vector().array()
+    u_prev      = project(model.u, model.Q).vector()
     
     # set an inner tolerance for PI
-    inner_tol   = config['coupled']['inner_tol']
-    max_iter    = config['coupled']['max_iter']
+    inner_tol   = coupled['inner_tol']
+    rel_tol     = coupled.get('rel_tol', 0.0)
+    max_iter    = coupled['max_iter']
 
     # Initialize a temperature field for visc. calc.
     if config['velocity']['use_T0']:
       model.T.vector().set_local( T0 * ones(len(model.T.vector().array())) )
     
-    if not config['coupled']['on']: max_iter = 1
+    if not coupled['on']: max_iter = 1
+    
+    # Anderson mixing of the enthalpy, from which the temperature and water
+    # content which couple the velocity to the enthalpy are found :
+    anderson = coupled['on'] and coupled.get('acceleration') == 'anderson' \
+               and config['velocity']['on'] and config['enthalpy']['on']
+    if anderson:
+      mixer = AndersonAcceleration(coupled.get('anderson_depth', 5),
+                                   coupled.get('anderson_beta',  1.0))
+    self.history = []
     
     # Perform a Picard iteration until the L_\infty norm of the velocity 
     # difference is less than tolerance
-    while inner_error > inner_tol and counter < max_iter:
+    while inner_error > inner_tol and rel_error > rel_tol \
+          and counter < max_iter:
+      
+      if anderson:
+        x = model.H.vector().array()
       
       # Solve surface mass balance and temperature boundary condition
       if config['surface_climate']['on']:
-        self.surface_climate_instance.solve()
+        with timers.time('surface climate'):
+          self.surface_climate_instance.solve()
 
       # Solve velocity
       if config['velocity']['on']:
-        self.velocity_instance.solve()
+        with timers.time('velocity'):
+          self.velocity_instance.solve()
         U = project(as_vector([model.u, model.v, model.w]))
         if config['log']:
-          File(outpath + 'U.pvd') << U
-          # if the velocity solve is full-stokes, save pressure too : 
-          if config['velocity']['approximation'] == 'stokes':
-            File(outpath + 'P.pvd') << model.P
+          with timers.time('write'):
+            File(outpath + 'U.pvd') << U
+            # if the velocity solve is full-stokes, save pressure too : 
+            if config['velocity']['approximation'] == 'stokes':
+              File(outpath + 'P.pvd') << model.P
         print_min_max(U, 'U')
 
       # Solve enthalpy (temperature, water content)
       if config['enthalpy']['on']:
-        self.enthalpy_instance.solve()
+        with timers.time('enthalpy'):
+          self.enthalpy_instance.solve()
         if config['log']: 
-          File(outpath + 'T.pvd')  << model.T   # save temperature
-          File(outpath + 'Mb.pvd') << model.Mb  # save melt rate
-          File(outpath + 'W.pvd')  << model.W   # save water content
+          with timers.time('write'):
+            File(outpath + 'T.pvd')  << model.T   # save temperature
+            File(outpath + 'Mb.pvd') << model.Mb  # save melt rate
+            File(outpath + 'W.pvd')  << model.W   # save water content
         print_min_max(model.T, 'T')
-
-      # Calculate L_infinity norm
-      if config['coupled']['on']:
-        u_new       = project(model.u, model.Q).vector().array()
-        diff        = (u_prev - u_new)
-        inner_error = diff.max()
+      
+      # mix the new enthalpy with the previous ones, and find the 
+      # temperature, at most the pressure-melting point, and the water 
+      # content consistent with it :
+      if anderson:
+        with timers.time('anderson'):
+          g = model.H.vector().array()
+          model.H.vector().set_local(mixer.update(x, g))
+          model.H.vector().apply('insert')
+          self.enthalpy_instance.update_temperature()
+
+      # Calculate L_infinity norm of the change, and relative to the velocity
+      if coupled['on']:
+        u_new       = project(model.u, model.Q).vector()
+        diff        = u_new.copy()
+        diff.axpy(-1.0, u_prev)
+        inner_error = diff.norm('linf')
+        rel_error   = inner_error / max(u_new.norm('linf'), DOLFIN_EPS)
         u_prev      = u_new
       
       counter += 1
+      self.history.append((counter, inner_error, rel_error))
+      timers.count('picard iterations')
       
-      print 'Picard iteration %i (max %i) done: r = %.3e (tol %.3e)' \
-            % (counter, max_iter, inner_error, inner_tol)
+      print 'Picard iteration %i (max %i) done: r = %.3e (tol %.3e), ' \
+            'r_rel = %.3e (tol %.3e)' \
+            % (counter, max_iter, inner_error, inner_tol, rel_error, rel_tol)
 
     # Solve age equation
     if config['age']['on']:
-      self.age_instance.solve()
-      if config['log']: File(outpath + 'age.pvd') << model.age  # save age
+      with timers.time('age'):
+        self.age_instance.solve()
+      if config['log']: 
+        with timers.time('write'):
+          File(outpath + 'age.pvd') << model.age  # save age
 
 
 class TransientSolver(object):
@@ -197,49 +295,142 @@ class TransientSolver(object):
       self.mass    = []
       self.t_log   = []
 
-    self.step_time = []
-    self.M_prev    = 1.0
+    # index maps from the degrees of freedom of the surface S and of the 
+    # mesh velocity to the vertices, computed once :
+    if config['periodic_boundary_conditions']:
+      self.d2v = dof_to_vertex_map(model.Q_non_periodic)
+      self.m2v = self.d2v[self.periodic_dofs()]
+    else:
+      self.d2v = dof_to_vertex_map(model.Q)
+      self.m2v = self.d2v
+
+    # velocity subcycling, see update_velocity() :
+    stepping             = config.get('time_stepping', {})
+    self.velocity_every  = stepping.get('velocity_every', None)
+    self.velocity_tol    = stepping.get('velocity_tol',   None)
+    self.velocity_extrap = stepping.get('velocity_extrapolation', 2.0)
+    self.velocity_solves = []   # (step, t, S, u, v, w) of the last solves
+    self.step            = 0
+
+    self.step_time  = []
+    self.dt_history = []
+    self.M_prev     = 1.0
+
+  def periodic_dofs(self):
+    """
+    Returns the index of the degree of freedom of the unconstrained space 
+    model.Q_non_periodic at the position of each degree of freedom of the 
+    periodic space model.Q, so that values may be copied between them.
+    """
+    model = self.model
+    mesh  = model.mesh
+    gdim  = mesh.geometry().dim()
+    x_p   = model.Q.dofmap().tabulate_all_coordinates(mesh)
+    x_n   = model.Q_non_periodic.dofmap().tabulate_all_coordinates(mesh)
+    x_p   = x_p.reshape((-1, gdim))
+    x_n   = x_n.reshape((-1, gdim))
+    index = dict((tuple(x), i) for i, x in enumerate(x_n))
+    return np.array([index[tuple(x)] for x in x_p], dtype='intc')
+
+  def cfl_time_step(self, h, cfl):
+    """
+    Returns the largest time step for which the current horizontal velocity
+    satisfies the CFL condition with Courant number <cfl> on cells of 
+    horizontal diameter <h>, the minimum over all processes.
+    """
+    model = self.model
+    u     = model.u.compute_vertex_values()
+    v     = model.v.compute_vertex_values()
+    U     = np.sqrt(u**2 + v**2)[model.flat_mesh.cells()].max(axis=1)
+    dt    = cfl * (h / np.maximum(U, DOLFIN_EPS)).min()
+    return MPI.min(mpi_comm_world(), float(dt))
+
+  def update_velocity(self, t, S):
+    """
+    Solves for the velocity at time <t> and surface <S>.  If either of 
+    config['time_stepping']['velocity_every'] or 'velocity_tol' is set, the
+    velocity is only solved for once at least 'velocity_every' time steps 
+    have passed, or the surface has changed by more than 'velocity_tol' 
+    since the last solve, and is otherwise extrapolated linearly in time 
+    from the last two solves.  The velocity is also solved for rather than 
+    extrapolated further past the last solve than 'velocity_extrapolation' 
+    (default 2) times the interval between the last two solves.
+    """
+    model = self.model
+    every = self.velocity_every
+    tol   = self.velocity_tol
+    hist  = self.velocity_solves
+    
+    # the extrapolation factor from the last two solves :
+    c = 0.0
+    if len(hist) > 1 and hist[-1][1] != hist[-2][1]:
+      c = (t - hist[-1][1]) / (hist[-1][1] - hist[-2][1])
+    
+    solve = (every is None and tol is None) or len(hist) == 0 \
+            or abs(c) > self.velocity_extrap
+    if not solve and every is not None:
+      solve = self.step - hist[-1][0] >= every
+    if not solve and tol is not None:
+      np.subtract(S, hist[-1][2], out=self.dS)
+      dS    = MPI.max(mpi_comm_world(), float(np.abs(self.dS, self.dS).max()))
+      solve = dS > tol
+
+    if solve:
+      model.U.vector().zero()
+      with timers.time('velocity'):
+        self.velocity_instance.solve()
+      hist.append((self.step, t, S.copy(), model.u.vector().get_local(),
+                   model.v.vector().get_local(), model.w.vector().get_local()))
+      del hist[:-3]   # one spare, in case a rejected step's solve is dropped
+      self.dS = np.empty_like(S)
+      self.dx = np.empty_like(hist[-1][3])
+    
+    else:
+      timers.count('velocity extrapolations')
+      for f, x_a, x_b in zip((model.u, model.v, model.w), 
+                             hist[-2][3:] if len(hist) > 1 else hist[-1][3:],
+                             hist[-1][3:]):
+        np.subtract(x_b, x_a, out=self.dx)
+        self.dx *= c
+        self.dx += x_b
+        f.vector().set_local(self.dx)
+        f.vector().apply('insert')
+
+  def discard_velocity_solves(self, t):
+    """
+    Forget the velocity solves made after time <t>, on the stages of a time 
+    step which has been rejected, so they are not extrapolated from.
+    """
+    self.velocity_solves[:] = [h for h in self.velocity_solves if h[1] <= t]
 
   def rhs_func_explicit(self, t, S, *f_args):
     """
     This function calculates the change in height of the surface of the
-    ice sheet.
+    ice sheet.  The surface <S> is raised in place to at least the minimum
+    thickness above the bed, self.S_min, set by solve().
     
     :param t : Time
-    :param S : Current height of the ice sheet
+    :param S : Current height of the ice sheet at the vertices
     :rtype   : Array containing rate of change of the ice surface values
     """
-    model             = self.model
-    config            = self.config
-    thklim            = config['free_surface']['thklim']
-    B                 = model.B.compute_vertex_values()
-    S[(S-B) < thklim] = thklim + B[(S-B) < thklim]
-    if config['periodic_boundary_conditions']:
-      #v2d = model.Q_non_periodic.dofmap().vertex_to_dof_map(model.flat_mesh)
-      d2v = dof_to_vertex_map(model.Q_non_periodic)
-    else:
-      #v2d = model.Q.dofmap().vertex_to_dof_map(model.flat_mesh)
-      d2v = dof_to_vertex_map(model.Q)
-    model.S.vector().set_local(S[d2v])
+    model  = self.model
+    config = self.config
+    
+    np.maximum(S, self.S_min, out=S)
+    np.take(S, self.d2v, out=self.S_d)
+    model.S.vector().set_local(self.S_d)
     model.S.vector().apply('insert')
    
     if config['velocity']['on']:
-      utemp = model.U.vector().get_local()
-      utemp[:] = 0.0
-      model.U.vector().set_local(utemp)
-      model.U.vector().apply('insert')
-      self.velocity_instance.solve()
-      if self.config['log']:
-        U = project(as_vector([model.u, model.v, model.w]))
-        self.file_U << (U, t)
+      self.update_velocity(t, S)
 
     if config['surface_climate']['on']:
-      self.surface_climate_instance.solve()
+      with timers.time('surface climate'):
+        self.surface_climate_instance.solve()
    
     if config['free_surface']['on']:
-      self.surface_instance.solve()
-      if self.config['log']:
-        self.file_S << (model.S, t)
+      with timers.time('free surface'):
+        self.surface_instance.solve()
  
     return model.dSdt.compute_vertex_values()
 
@@ -248,6 +439,17 @@ class TransientSolver(object):
     Performs the physics, evaluating and updating the enthalpy and age as 
     well as storing the velocity, temperature, and the age in vtk files.
 
+    If config['time_stepping']['adaptive'] is True, the time step starts at
+    config['time_step'] and is adapted each step, limited by the CFL 
+    condition with Courant number 'cfl' and by the difference between the 
+    Euler and two-stage estimates of the surface, which should not exceed 
+    'tol', within the bounds 'dt_min' and 'dt_max'.  The (time, time step, 
+    error) of each step are kept in self.dt_history.
+    
+    If config['free_surface']['time_scheme'] is implicit, each step is a 
+    single implicit stage of the free surface, limited by the CFL condition
+    only on the first step, with the error estimated from the change of 
+    the rate of change of the surface between steps.
     """
     model  = self.model
     config = self.config
@@ -259,65 +461,178 @@ class TransientSolver(object):
    
     mesh   = model.mesh 
     smb    = model.smb
-    sigma  = model.sigma
-
-    S      = model.S
-    B      = model.B
- 
+    
     smb.interpolate(config['free_surface']['observed_smb'])
 
-    if config['periodic_boundary_conditions']:
-      d2v = dof_to_vertex_map(model.Q_non_periodic)
-      mhat_non = Function(model.Q_non_periodic)
-    else:
-      d2v = dof_to_vertex_map(model.Q)
+    # the bed and the sigma coordinate do not change, and the surface is 
+    # kept at the vertices between steps :
+    B_a        = model.B.compute_vertex_values()
+    sigma_v    = model.sigma.compute_vertex_values()
+    z          = mesh.coordinates()[:, 2]
+    self.S_min = B_a + thklim
+    self.S_d   = np.empty(len(self.d2v))
+    m_d        = np.empty(len(self.m2v))
+    S_0        = model.S.compute_vertex_values()
+    S_1        = np.empty_like(S_0)
+    S_2        = np.empty_like(S_0)
+    work       = np.empty_like(S_0)
+
+    # adaptive time stepping parameters :
+    stepping = config.get('time_stepping', {})
+    adaptive = stepping.get('adaptive', False)
+    if adaptive:
+      cfl    = stepping.get('cfl',    0.5)
+      tol    = stepping.get('tol',    1.0)
+      dt_min = stepping.get('dt_min', 1e-3 * dt)
+      dt_max = stepping.get('dt_max', 1e2  * dt)
+      
+      # horizontal diameter of each cell of the flat mesh :
+      x   = model.flat_mesh.coordinates()[model.flat_mesh.cells()][:,:,:2]
+      d   = x[:, :, np.newaxis, :] - x[:, np.newaxis, :, :]
+      h_c = np.sqrt((d**2).sum(axis=3)).reshape((len(x), -1)).max(axis=1)
+    
+    # the free surface may be advanced implicitly in a single stage :
+    implicit = config['free_surface']['on'] and \
+               self.surface_instance.scheme != 'explicit'
+    f_prev   = None
 
     # Loop over all times
     while t <= t_end:
 
-      B_a = B.compute_vertex_values()
-      S_v = S.compute_vertex_values()
-      
       tic = time()
 
-      S_0 = S_v
-      f_0 = self.rhs_func_explicit(t, S_0)
-      S_1 = S_0 + dt*f_0
-      S_1[(S_1-B_a) < thklim] = thklim + B_a[(S_1-B_a) < thklim]
-      S.vector().set_local(S_1[d2v])
-      S.vector().apply('')
-
-      f_1                     = self.rhs_func_explicit(t, S_1)
-      S_2                     = 0.5*S_0 + 0.5*S_1 + 0.5*dt*f_1
-      S_2[(S_2-B_a) < thklim] = thklim + B_a[(S_2-B_a) < thklim] 
-      S.vector().set_local(S_2[d2v])
-      S.vector().apply('')
-     
-      mesh.coordinates()[:, 2] = sigma.compute_vertex_values()*(S_2 - B_a) + B_a
-      if config['periodic_boundary_conditions']:
-        temp = (S_2[d2v] - S_0[d2v])/dt * sigma.vector().get_local()
-        mhat_non.vector().set_local(temp)
-        mhat_non.vector().apply('')
-        m_temp = project(mhat_non,model.Q)
-        model.mhat.vector().set_local(m_temp.vector().get_local())
-        model.mhat.vector().apply('')
+      # with an implicit free surface, take a single stage, not limited by 
+      # the CFL condition except on the first step, which has no estimate 
+      # of the error.  The error is estimated by dt**2 / 2 times the second
+      # derivative of the surface, from the change of the mean rate of 
+      # change of the surface since the previous step, and the step is 
+      # repeated with a smaller one while it exceeds the tolerance :
+      if implicit:
+        if adaptive:
+          dt = min(dt, dt_max)
+          if f_prev is None:
+            dt = min(dt, self.cfl_time_step(h_c, cfl))
+          dt = max(min(dt, t_end - t), dt_min)
+        self.surface_instance.dt.assign(dt)
+        f_0 = self.rhs_func_explicit(t, S_0)
+        
+        while True:
+          np.multiply(f_0, dt, out=S_2)
+          S_2 += S_0
+          np.maximum(S_2, self.S_min, out=S_2)
+          
+          if not adaptive:
+            break
+          if f_prev is None:
+            err, factor = None, 1.0
+            break
+          np.subtract(f_0, f_prev, out=work)
+          dfdt   = 2 * np.abs(work, work).max() / (dt + dt_prev)
+          err    = 0.5 * dt**2 * MPI.max(mpi_comm_world(), float(dfdt))
+          factor = min(max(0.9 * np.sqrt(tol / max(err, DOLFIN_EPS)), 0.2), 
+                       2.0)
+          if err <= tol or dt <= dt_min:
+            break
+          print "::: step of %g rejected, error %g > %g :::" % (dt, err, tol)
+          timers.count('rejected time steps')
+          dt = max(factor * dt, dt_min)
+          
+          # only the surface is solved for again, with the same velocity :
+          self.surface_instance.dt.assign(dt)
+          with timers.time('free surface'):
+            self.surface_instance.solve()
+          f_0 = model.dSdt.compute_vertex_values()
+        
+        if adaptive:
+          f_prev  = f_0
+          dt_prev = dt
+      
       else:
-        temp = (S_2[d2v] - S_0[d2v])/dt * sigma.vector().get_local()
-        model.mhat.vector().set_local(temp)
-        model.mhat.vector().apply('')
+        f_0 = self.rhs_func_explicit(t, S_0)
+      
+        # limit the step by the CFL condition of the velocity at S_0 and the 
+        # end of the run :
+        if adaptive:
+          dt = min(dt, self.cfl_time_step(h_c, cfl), dt_max)
+          dt = max(min(dt, t_end - t), dt_min)
+      
+        # take the two-stage step, and if adaptive, repeat with a smaller 
+        # step while the difference to the Euler stage exceeds the tolerance :
+        while True:
+          np.multiply(f_0, dt, out=S_1)
+          S_1 += S_0
+          f_1  = self.rhs_func_explicit(t + dt, S_1)
+
+          np.multiply(f_1, dt, out=S_2)
+          S_2 += S_0
+          S_2 += S_1
+          S_2 *= 0.5
+          np.maximum(S_2, self.S_min, out=S_2)
+        
+          if not adaptive:
+            break
+          np.subtract(S_2, S_1, out=work)
+          err    = MPI.max(mpi_comm_world(), float(np.abs(work, work).max()))
+          factor = min(max(0.9 * np.sqrt(tol / max(err, DOLFIN_EPS)), 0.2), 2.0)
+          if err <= tol or dt <= dt_min:
+            break
+          print "::: step of %g rejected, error %g > %g :::" % (dt, err, tol)
+          timers.count('rejected time steps')
+          self.discard_velocity_solves(t)
+          dt = max(factor * dt, dt_min)
+      
+      # the enthalpy and age are advanced by the same step :
+      if config['enthalpy']['on']:
+        self.enthalpy_instance.dt.assign(dt)
+      if config['age']['on']:
+        self.age_instance.dt.assign(dt)
+     
+      # move the mesh to the new surface and set the mesh velocity :
+      with timers.time('mesh update'):
+        np.take(S_2, self.d2v, out=self.S_d)
+        model.S.vector().set_local(self.S_d)
+        model.S.vector().apply('insert')
+        
+        np.subtract(S_2, B_a, out=work)
+        work  *= sigma_v
+        work  += B_a
+        z[:]   = work
+        
+        np.subtract(S_2, S_0, out=work)
+        work  *= sigma_v
+        work  /= dt
+        np.take(work, self.m2v, out=m_d)
+        model.mhat.vector().set_local(m_d)
+        model.mhat.vector().apply('insert')
+      
+      # log the velocity and surface once the step is accepted :
+      if config['log']:
+        if config['velocity']['on']:
+          U = project(as_vector([model.u, model.v, model.w]))
+          with timers.time('write'):
+            self.file_U << (U, t + dt)
+        if config['free_surface']['on']:
+          with timers.time('write'):
+            self.file_S << (model.S, t + dt)
+      
       # Calculate enthalpy update
       if self.config['enthalpy']['on']:
-        self.enthalpy_instance.solve(H0=model.H, Hhat=model.H, uhat=model.u, 
-                                   vhat=model.v, what=model.w, mhat=model.mhat)
+        with timers.time('enthalpy'):
+          self.enthalpy_instance.solve(H0=model.H, Hhat=model.H, 
+                                       uhat=model.u, vhat=model.v, 
+                                       what=model.w, mhat=model.mhat)
         if self.config['log']:
-          self.file_T << (model.T, t)
+          with timers.time('write'):
+            self.file_T << (model.T, t)
 
       # Calculate age update
       if self.config['age']['on']:
-        self.age_instance.solve(A0=model.A, Ahat=model.A, uhat=model.u, 
-                                vhat=model.v, what=model.w, mhat=model.mhat)
+        with timers.time('age'):
+          self.age_instance.solve(A0=model.A, Ahat=model.A, uhat=model.u, 
+                                  vhat=model.v, what=model.w, mhat=model.mhat)
         if config['log']: 
-          self.file_a << (model.age, t)
+          with timers.time('write'):
+            self.file_a << (model.age, t)
 
       # Store velocity, temperature, and age to vtk files
       if self.config['log']:
@@ -327,12 +642,25 @@ class TransientSolver(object):
 
       # Increment time step
       if MPI.rank(mpi_comm_world())==0:
-        string = 'Time: {0}, CPU time for last time step: {1}, Mass: {2}'
-        print string.format(t, time()-tic, M/self.M_prev)
+        string = 'Time: {0}, time step: {1}, CPU time for last time ' \
+                 'step: {2}, Mass: {3}'
+        print string.format(t, dt, time()-tic, M/self.M_prev)
 
       self.M_prev = M
       t          += dt
       self.step_time.append(time() - tic)
+      timers.count('time steps')
+      self.step += 1
+      
+      # the new surface is the start of the next step :
+      S_0, S_2 = S_2, S_0
+      
+      # grow or shrink the next step by the error of this one :
+      if adaptive:
+        self.dt_history.append((t, dt, err))
+        if t >= t_end:
+          break
+        dt = min(factor * dt, dt_max)
 
 class AdjointSolver(object):
   """
@@ -392,7 +720,8 @@ class AdjointSolver(object):
 
   def solve(self):
     r""" 
-    Perform the optimization.
+    Perform the optimization.  The evaluations of the objective function and 
+    its gradient are timed as 'adjoint I' and 'adjoint J' in helper.timers.
 
     First, we define functions that return the objective function and Jacobian.
     These are passed to scipy's fmin_l_bfgs_b, which is a python wrapper for the
@@ -483,7 +812,8 @@ class AdjointSolver(object):
       for ii,c in enumerate(config['adjoint']['control_variable']):
         set_local_from_global(c, c_array[ii*n:(ii+1)*n])
       self.forward_model.solve()
-      I = assemble(self.adjoint_instance.I)  #FIXME: ISMIP_HOM inverse C fails
+      with timers.time('assemble'):
+        I = assemble(self.adjoint_instance.I)  #FIXME: ISMIP_HOM inverse C fails
       return I
  
     def J(c_array, *args):
@@ -500,17 +830,20 @@ class AdjointSolver(object):
       # so that we can see the impact of every line search update on the
       # variables of interest.
       Js = []
-      for JJ in self.adjoint_instance.J:
-        Js.extend(get_global(assemble(JJ)))
+      with timers.time('assemble'):
+        for JJ in self.adjoint_instance.J:
+          Js.extend(get_global(assemble(JJ)))
       Js   = array(Js)
       # FIXME: project and extrude ruin the output for paraview, we just 
       #        save when finished for now.
       U    = project(as_vector([model.u, model.v, model.w]))
       dSdt = project(- (model.u*model.S.dx(0) + model.v*model.S.dx(1)) \
                      + model.w + model.adot)
-      file_b_pvd    << model.extrude(model.beta2, 3, 2)
-      file_u_pvd    << U
-      file_dSdt_pvd << dSdt
+      beta2_e = model.extrude(model.beta2, 3, 2)
+      with timers.time('write'):
+        file_b_pvd    << beta2_e
+        file_u_pvd    << U
+        file_dSdt_pvd << dSdt
       return Js
 
     #===========================================================================
@@ -548,8 +881,9 @@ class AdjointSolver(object):
     print bounds
     
     # minimize I with initial guess beta_0 and gradient J :
-    mopt, f, d = fmin_l_bfgs_b(I, beta_0, fprime=J, bounds=bounds,
-                               maxfun=maxfun, iprint=iprint)
+    mopt, f, d = fmin_l_bfgs_b(timers.timed('adjoint I', I), beta_0, 
+                               fprime=timers.timed('adjoint J', J), 
+                               bounds=bounds, maxfun=maxfun, iprint=iprint)
 
     n = len(mopt)/len(config['adjoint']['control_variable'])
     for ii,c in enumerate(config['adjoint']['control_variable']):
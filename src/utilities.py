@@ -7,23 +7,82 @@ Utilities file:
   basis functions.
 
 """
+import os
 import sys
+import hashlib
 import subprocess
 src_directory = '../'
 sys.path.append(src_directory)
 
-from scipy.io          import loadmat, savemat
+from scipy.io          import loadmat, savemat, netcdf_file
 from scipy.interpolate import RectBivariateSpline, NearestNDInterpolator
+from scipy.ndimage     import minimum_filter
+from numpy             import save, load
 from pylab             import array, shape, linspace, ones, isnan, all, zeros, \
                               meshgrid, figure, show, size, hstack, vstack, \
-                              argmin
+                              argmin, float64, searchsorted, clip, where, ceil, \
+                              diff, arange, array_split, dot, inv
+from matplotlib.tri    import Triangulation
+from multiprocessing   import Pool
+from osgeo             import gdal, osr
 #from gmshpy            import GModel, GmshSetOption, FlGui
 from fenics            import interpolate, project, Expression, Function, \
                               vertices, Mesh, MeshEditor, FunctionSpace, \
-                              RectangleMesh
-from data.data_factory import DataFactory
+                              RectangleMesh, File, Point
+from data.data_factory import DataFactory, interpolation_matrix, digest
 from pyproj            import Proj, transform
 
+class FieldDict(dict):
+  """
+  Dictionary of the data arrays of a DataInput object.  A field which has 
+  not yet been accessed is loaded by the DataInput object <di> on first 
+  access, so that fields which are never used are never processed.
+  """
+  def __init__(self, di):
+    dict.__init__(self)
+    self.di = di
+
+  def __missing__(self, fn):
+    return self.di.load_field(fn)
+
+
+# state shared with the worker processes of DataOutput.resample(), which 
+# inherit it when they are forked :
+resample_state = {}
+
+def resample_rows(rows):
+  """
+  Evaluate the grid evaluator in <resample_state> at the rows with indices 
+  <rows> of the grid; called in the worker processes of 
+  DataOutput.resample().
+  """
+  s = resample_state
+  return s['evaluate'](s['x'], s['y'][rows])
+
+
+def get_scattered_function(data, func_space):
+  """
+  Returns a dolfin Function in FunctionSpace <func_space> with values of the
+  scattered data field <data>, as returned by the DataFactory get_*_points()
+  methods, linearly interpolated from its triangulation directly onto every
+  degree of freedom, without an intermediate grid.  The mesh must be in the
+  projection of <data>; degrees of freedom outside of the triangulation are 
+  zero.  The interpolation weights are cached, so later calls for the same 
+  function space are a sparse matrix-vector product.
+  """
+  mesh   = func_space.mesh()
+  gdim   = mesh.geometry().dim()
+  coords = func_space.dofmap().tabulate_all_coordinates(mesh)
+  coords = coords.reshape((-1, gdim))
+  W      = interpolation_matrix(data['key'], data['x'], data['y'], 
+                                data['triangles'], coords[:,0], coords[:,1])
+  
+  f = Function(func_space)
+  f.vector().set_local(W * data['point_data'])
+  f.vector().apply('insert')
+  return f
+
+
 class DataInput(object):
   """ 
   This object brokers the relation between the driver file and a number of
@@ -35,8 +94,23 @@ class DataInput(object):
     3) Project the data onto a finite element mesh that is generated based
        on the extents of the input data set.
   """
+  # dof coordinates of target function spaces, transformed into the source
+  # projection, keyed by (mesh, space, source proj., target proj.) so that
+  # every field and every DataInput with the same projections share them :
+  coord_cache = {}
+
+  # directory in which the dof vectors returned by get_projection(),
+  # get_interpolation() and get_nearest() are kept between runs; set this 
+  # to a directory name to enable the cache :
+  cache_dir = None
+
+  # digests of the coordinates and cells of the meshes, keyed by mesh id, 
+  # computed once per mesh for the cache keys :
+  mesh_digests = {}
+
   def __init__(self, direc, files, flip=False, mesh=None, gen_space=True, 
-               zero_edge=False, bool_data=False, req_dg=False):
+               zero_edge=False, bool_data=False, req_dg=False, lazy=False,
+               crop=False, halo=10):
     """
     The following data are used to initialize the class :
     
@@ -48,14 +122,31 @@ class DataInput(object):
       zero_edge : Make edges of domain -0.002?
       bool_data : Convert data to boolean?
       req_dg    : Some field may require DG space?
+      lazy      : Load and scan each field only when it is first used?
+      crop      : Crop the data to the bounding box of <mesh>?
+      halo      : Number of grid cells kept around the bounding box of <mesh>
+                  when cropping.
     
     Based on thickness extents, create a rectangular mesh object.
     Also define the function space as continious galerkin, order 1.
-    """
-    self.directory  = direc
-    self.data       = {}        # dictionary of converted matlab data
-    self.rem_nans   = False
-    self.chg_proj   = False     # change to other projection flag
+
+    If <crop> is True the fields are always loaded lazily, and the crop is 
+    made when the first field is loaded, so that a call to 
+    change_projection() made before then is taken into account.
+    """
+    self.directory   = direc
+    self.data        = FieldDict(self)  # dictionary of converted matlab data
+    self.pending     = {}               # fields not yet loaded
+    self.rem_nans    = False
+    self.chg_proj    = False            # change to other projection flag
+    self.flip        = flip
+    self.zero_edge   = zero_edge
+    self.bool_data   = bool_data
+    self.crop        = crop and mesh != None and gen_space
+    self.halo        = halo
+    self.crop_window = None
+    self.edits       = {}               # set_data_* edits made to each field
+    self.sources     = {}               # identities of the source fields
     
     first = True  # initialize domain by first file's extents
 
@@ -66,21 +157,19 @@ class DataInput(object):
     
     print "::: creating %s DataInput object :::" % self.name
     
-    # process the data files :
+    # register the data files :
+    fields = []
     for fn in files:
      
       if direc == None and type(files) == dict:
         d_dict = files[fn]
-    
       
-      elif direc != None:
-        d_dict = loadmat(direc + fn)
-        d_dict['projection']     = d_dict['projection'][0]
-        d_dict['standard lat']   = d_dict['standard lat'][0]
-        d_dict['standard lon']   = d_dict['standard lon'][0]
-        d_dict['lat true scale'] = d_dict['lat true scale'][0]
+      # only the first matlab file need be read to initialize the extents :
+      elif direc != None and first:
+        d_dict = self.read_matlab(direc + fn)
       
-      d = d_dict["map_data"]
+      else:
+        d_dict = None
      
       # initialize extents :
       if first: 
@@ -97,28 +186,14 @@ class DataInput(object):
         self.y          = linspace(self.y_min, self.y_max, self.ny)
         self.good_x     = array(ones(len(self.x)), dtype=bool)      # no NaNs
         self.good_y     = array(ones(len(self.y)), dtype=bool)      # no NaNs
+        self.kept_x     = self.good_x.copy()    # cols present in self.data
+        self.kept_y     = self.good_y.copy()    # rows present in self.data
+        self.extents    = (self.x_min, self.x_max, self.y_min, self.y_max,
+                           self.nx,    self.ny)
         first           = False
-  
-      # identify, but not remove the NaNs : 
-      self.identify_nans(d, fn)
-     
-      # make edges all zero for interpolation of interior regions :
-      if zero_edge:
-        d[:,0] = d[:,-1] = d[0,:] = d[-1,:] = -0.002
-        d[:,1] = d[:,-2] = d[1,:] = d[-2,:] = -0.002
-
-      # convert to boolean : 
-      if bool_data: d[d > 0] = 1
       
-      # reflect over the x-axis :
-      if flip: d = d[::-1, :]
-      
-      # add to the dictionary of arrays :
-      self.data[fn.split('.')[0]] = d
-
-    # remove un-needed rows/cols from data: 
-    if self.rem_nans:
-      self.remove_nans()
+      fields.append(fn.split('.')[0])
+      self.pending[fields[-1]] = (fn, d_dict)
     
     if gen_space:
       # define a FEniCS Rectangle over the domain :
@@ -144,13 +219,130 @@ class DataInput(object):
            + " +k=1 +x_0=0 +y_0=0 +no_defs +a=6378137 +rf=298.257223563" \
            + " +towgs84=0.000,0.000,0.000 +to_meter=1"
     self.p = Proj(proj)
+    
+    # process every field now unless asked not to :
+    if not lazy and not self.crop:
+      for fn in fields:
+        self.load_field(fn)
+
+  def read_matlab(self, filename):
+    """
+    Return the dictionary of data from the matlab file <filename>.
+    """
+    d_dict = loadmat(filename)
+    d_dict['projection']     = d_dict['projection'][0]
+    d_dict['standard lat']   = d_dict['standard lat'][0]
+    d_dict['standard lon']   = d_dict['standard lon'][0]
+    d_dict['lat true scale'] = d_dict['lat true scale'][0]
+    return d_dict
+
+  def load_field(self, fn):
+    """
+    Read the field <fn>, crop it, identify its rows and columns of NaNs, 
+    apply the processing options given at initialization, and add it to the 
+    dictionary of data, which is returned.
+    """
+    if fn not in self.pending:
+      raise KeyError(fn)
+    
+    if self.crop and self.crop_window == None:
+      self.crop_to_mesh()
+    
+    # identify the source before the set_data_* methods may change it :
+    if DataInput.cache_dir != None:
+      self.source_id(fn)
+    
+    filename, d_dict = self.pending.pop(fn)
+    if d_dict == None:
+      d_dict = self.read_matlab(self.directory + filename)
+    
+    d = d_dict["map_data"]
+    
+    # reflect over the x-axis :
+    if self.flip: d = d[::-1, :]
+    
+    # keep only the region about the mesh :
+    if self.crop_window != None:
+      j0, j1, i0, i1 = self.crop_window
+      d = d[j0:j1, i0:i1]
+  
+    # identify, but not remove the NaNs : 
+    self.identify_nans(d, fn)
+    
+    # copy the cropped region so that the full dataset may be freed :
+    if self.crop_window != None:
+      d = d.copy()
+    
+    # make edges all zero for interpolation of interior regions :
+    if self.zero_edge:
+      d[:,0] = d[:,-1] = d[0,:] = d[-1,:] = -0.002
+      d[:,1] = d[:,-2] = d[1,:] = d[-2,:] = -0.002
+
+    # convert to boolean : 
+    if self.bool_data: d[d > 0] = 1
+    
+    # remove the rows/cols already removed from the other fields :
+    if not all(self.kept_y):
+      d = d[self.kept_y, :]
+    if not all(self.kept_x):
+      d = d[:, self.kept_x]
+    
+    # add to the dictionary of arrays :
+    self.data[fn] = d
+
+    # remove un-needed rows/cols from data: 
+    if self.rem_nans:
+      self.remove_nans()
+    
+    return self.data[fn]
+
+  def crop_to_mesh(self):
+    """
+    Restrict the extents of this DataInput to the bounding box of its mesh 
+    in this data's projection, enlarged by <halo> grid cells on every side.
+    Must be called before any field is loaded.
+    """
+    coord = self.mesh.coordinates()
+    x     = coord[:,0]
+    y     = coord[:,1]
+    if self.chg_proj:
+      x, y = transform(self.new_p, self.p, x, y)
+      x, y = array(x), array(y)
+    
+    i0 = max(searchsorted(self.x, x.min(), 'right') - 1 - self.halo, 0)
+    i1 = min(searchsorted(self.x, x.max()) + 1 + self.halo, self.nx)
+    j0 = max(searchsorted(self.y, y.min(), 'right') - 1 - self.halo, 0)
+    j1 = min(searchsorted(self.y, y.max()) + 1 + self.halo, self.ny)
+    
+    print "::: cropping %s from %i x %i to %i x %i points :::" \
+          % (self.name, self.nx, self.ny, i1 - i0, j1 - j0)
+    
+    self.crop_window = (j0, j1, i0, i1)
+    self.x           = self.x[i0:i1]
+    self.y           = self.y[j0:j1]
+    self.x_min       = self.x.min()
+    self.x_max       = self.x.max()
+    self.y_min       = self.y.min()
+    self.y_max       = self.y.max()
+    self.nx          = len(self.x)
+    self.ny          = len(self.y)
+    self.good_x      = array(ones(self.nx), dtype=bool)
+    self.good_y      = array(ones(self.ny), dtype=bool)
+    self.kept_x      = self.good_x.copy()
+    self.kept_y      = self.good_y.copy()
 
   def change_projection(self, di):
     """
     change the projection of this data to that of the <di> DataInput object's 
     projection.  The works only if the object was created with the parameter
-    create_proj = True.
-    """
+    create_proj = True.  The get_*_function methods, and get_projection(),
+    get_interpolation() and get_nearest() which use them, transform the 
+    target coordinates once per mesh and projection pair and re-use them for
+    every field; the Expression methods transform point-by-point.
+    """
+    if self.crop_window != None:
+      print "Warning: %s was cropped before its projection was changed." \
+            % self.name
     self.chg_proj = True
     self.new_p    = di.p
 
@@ -176,39 +368,36 @@ class DataInput(object):
 
     d     = float64(specific.data[fn_spec])   # original matlab spec dataset
 
-    # get arrays of x-values for specific domain
-    xs    = specific.x
-    ys    = specific.y
-    nx    = specific.nx
-    ny    = specific.ny
-    
-    for v in vertices(self.mesh):
-      # mesh vertex x,y coordinate :
-      i   = v.index()
-      p   = v.point()
-      x   = p.x()
-      y   = p.y()
-      
-      # indexes of closest datapoint to specific dataset's x and y domains :
-      idx = abs(xs - x).argmin()
-      idy = abs(ys - y).argmin()
-      
-      # data value for closest value and square around the value in question :
-      dv  = d[idy, idx] 
-      db  = d[max(0,idy-r) : min(ny, idy+r),  max(0, idx-r) : min(nx, idx+r)]
+    # mark every grid point whose square of half-width <r> around it is 
+    # entirely above <val>, i.e., which is not near an edge of the specific 
+    # dataset.  This is a sliding-window minimum over the boolean grid, with 
+    # the window clipped at the borders of the grid :
+    if r > 0:
+      above = array(d > val, dtype='uint8')
+      safe  = minimum_filter(above, size=2*r, mode='constant', cval=1)
+      safe  = array(safe, dtype=bool)
+    else:
+      safe  = ones(shape(d), dtype=bool)
+    
+    # indexes of closest datapoints to every mesh vertex x,y coordinate in 
+    # the specific dataset's x and y domains :
+    coord    = self.mesh.coordinates()
+    idx, idy = specific.nearest_indices(coord[:,0], coord[:,1])
+    
+    # data value for closest value :
+    dv    = d[idy, idx]
       
-      # if the vertex is in the domain of the specific dataset, and the value 
-      # of the dataset at this point is not abov <val>, set the array value 
-      # of the main file to this new specific region's value.
-      if dv > val:
-        #print "found:", x, y, idx, idy, v.index()
-        # if the values is not near an edge, make the value equal to the 
-        # nearest specific region's dataset value, otherwise, use the 
-        # specific region's projected value :
-        if all(db > val):
-          uocom[i] = uscom[i]
-        else :
-          uocom[i] = dv
+    # if the vertex is in the domain of the specific dataset, and the value 
+    # of the dataset at this point is not abov <val>, set the array value 
+    # of the main file to this new specific region's value.  If the value is 
+    # not near an edge, make the value equal to the specific region's 
+    # projected value, otherwise, use the nearest specific region's dataset 
+    # value :
+    inside        = dv > val
+    interior      = inside &  safe[idy, idx]
+    edge          = inside & ~safe[idy, idx]
+    uocom[interior] = uscom[interior]
+    uocom[edge]     = dv[edge]
     
     # set the values of the projected original dataset equal to the assimilated
     # dataset :
@@ -242,10 +431,13 @@ class DataInput(object):
   def remove_nans(self):
     """
     remove extra rows/cols from data where NaNs were identified and set the 
-    extents to those of the good x and y values.
+    extents to those of the good x and y values.  Fields loaded afterwards
+    have the same rows/cols removed by load_field().
     """
-    self.x     = self.x[self.good_x]
-    self.y     = self.y[self.good_y]
+    good_x     = self.good_x[self.kept_x]
+    good_y     = self.good_y[self.kept_y]
+    self.x     = self.x[good_x]
+    self.y     = self.y[good_y]
     self.x_min = self.x.min()
     self.x_max = self.x.max()
     self.y_min = self.y.min()
@@ -255,8 +447,12 @@ class DataInput(object):
     
     print "::::::::REMOVING NaNs::::::::"
     for i in self.data.keys():
-      self.data[i] = self.data[i][self.good_y, :          ]
-      self.data[i] = self.data[i][:,           self.good_x]
+      self.data[i] = self.data[i][good_y, :     ]
+      self.data[i] = self.data[i][:,      good_x]
+    
+    self.kept_x   = self.good_x.copy()
+    self.kept_y   = self.good_y.copy()
+    self.rem_nans = False
 
   def set_data_min(self, fn, boundary, val):
     """
@@ -266,6 +462,7 @@ class DataInput(object):
     d                = self.data[fn]
     d[d <= boundary] = val
     self.data[fn]    = d
+    self.edits.setdefault(fn, []).append(('min', boundary, val))
 
   def set_data_max(self, fn, boundary, val):
     """
@@ -275,6 +472,7 @@ class DataInput(object):
     d                = self.data[fn]
     d[d >= boundary] = val
     self.data[fn]    = d
+    self.edits.setdefault(fn, []).append(('max', boundary, val))
 
   def set_data_val(self, fn, old_val, new_val):
     """
@@ -284,11 +482,18 @@ class DataInput(object):
     d                = self.data[fn]
     d[d == old_val]  = new_val
     self.data[fn]    = d
+    self.edits.setdefault(fn, []).append(('val', old_val, new_val))
 
   def get_interpolation(self,fn,kx=3,ky=3):
-    interp = self.get_spline_expression(fn,kx=kx,ky=ky)
-    proj   = interpolate(interp, self.func_space)
-    return proj
+    """
+    Return the interpolation of data <fn> onto this DataInput's function space.
+    Since the function space is Lagrange, this is just the spline evaluated at
+    the degrees of freedom, which is done in one batch call.
+    """
+    def compute():
+      return self.get_spline_function(fn, kx=kx, ky=ky)
+    return self.get_cached_function('interpolation', fn, self.func_space, 
+                                    (kx, ky), compute)
 
   def get_projection(self, fn, dg=False, near=False, 
                      bool_data=False, kx=3, ky=3):
@@ -301,27 +506,143 @@ class DataInput(object):
     If <dg> is True, use a discontinuous space, otherwise, continuous.
 
     If <bool_data> is True, convert all values > 0 to 1.
+
+    The data are sampled at the degrees of freedom of the continuous space 
+    in one batch, with the coordinates transformed once per mesh and 
+    projection pair by get_dof_coordinates(), rather than point-by-point 
+    through an Expression.  This is the same function an Expression in the
+    continuous element gives, so the projection onto the continuous space 
+    is the sampled function itself.
     """
-    print "::: getting %s projection :::" % fn
+    def compute():
+      print "::: getting %s projection :::" % fn
 
+      if dg or near:
+        interp = self.get_nearest_function(fn, bool_data=bool_data)
+      else:
+        interp = self.get_spline_function(fn, kx=kx, ky=ky, 
+                                          bool_data=bool_data)
+      
+      if dg:
+        proj = project(interp, self.func_space_dg)
+      else:
+        proj = interp
+          
+      return proj
+    
     if dg:
-      interp = self.get_nearest_expression(fn, bool_data=bool_data)
-      proj   = project(interp, self.func_space_dg)
+      func_space = self.func_space_dg
+    else:
+      func_space = self.func_space
+    return self.get_cached_function('projection', fn, func_space, 
+                                    (dg, near, bool_data, kx, ky), compute)
+
+  def get_cached_function(self, kind, fn, func_space, opts, compute):
+    """
+    Return the Function in <func_space> of data <fn> made by <compute>(), 
+    loading its dof vector from DataInput.cache_dir if it has been computed 
+    by a previous run with the same mesh, dataset, field, method <kind>, 
+    options <opts>, projection, and set_data_* edits.  Otherwise, call 
+    <compute>() and save the result in the cache.  If cache_dir is None,
+    this is simply <compute>().
+    """
+    if DataInput.cache_dir == None:
+      return compute()
+
+    filename = self.cache_filename(kind, fn, func_space, opts)
     
+    if os.path.isfile(filename):
+      f = Function(func_space)
+      v = load(filename)
+      if len(v) == f.vector().local_size():
+        print "::: loading %s %s of %s from cache :::" % (fn, kind, self.name)
+        f.vector().set_local(v)
+        f.vector().apply('insert')
+        return f
+
+    f = compute()
+    
+    # write to a temporary file first so that runs sharing the cache never 
+    # read a partly written file :
+    if not os.path.isdir(DataInput.cache_dir):
+      try:
+        os.makedirs(DataInput.cache_dir)
+      except OSError:
+        pass
+    tmp = filename + '.%i.tmp' % os.getpid()
+    with open(tmp, 'wb') as fh:
+      save(fh, f.vector().array())
+    os.rename(tmp, filename)
+    return f
+
+  def cache_filename(self, kind, fn, func_space, opts):
+    """
+    Return the name of the cache file for data <fn> sampled by method <kind>
+    with options <opts> onto <func_space>.  The name is a hash of everything
+    the values depend on : the identities of the source fields, as given by
+    source_id(), the extents of the source grid, the processing options and
+    edits, the projections, and the digest of the mesh, so that a file is 
+    never used with a different mesh, partition, projection, or dataset.
+    No field is read to make the name.
+    """
+    if self.chg_proj:
+      proj = (self.p.srs, self.new_p.srs)
     else:
-      if near:
-        interp = self.get_nearest_expression(fn, bool_data=bool_data)
-        proj   = project(interp, self.func_space)
-      else:
-        interp = self.get_spline_expression(fn,kx=kx,ky=ky,bool_data=bool_data)
-        proj   = project(interp, self.func_space)
-        
-    return proj
+      proj = (self.p.srs, None)
+    
+    # rows and cols of NaNs of every field cut the grid of the others :
+    names   = sorted(set(self.pending.keys()) | set(self.data.keys()))
+    sources = [(n, self.source_id(n)) for n in names]
+    
+    key = (kind, self.name, fn, opts, proj, self.flip, self.zero_edge,
+           self.bool_data, self.crop, self.halo, self.edits.get(fn, []),
+           self.extents, sources, str(func_space.ufl_element()), 
+           func_space.dim(), self.mesh_digest(func_space.mesh()))
+    
+    h = hashlib.sha1(repr(key))
+    return os.path.join(DataInput.cache_dir, h.hexdigest() + '.npy')
+
+  def source_id(self, fn):
+    """
+    Return the identity of the source of field <fn> used in the cache keys,
+    computed once per field : the digest written to the raster store by 
+    DataFactory.convert() if there is one, the name, size and modification
+    time of the matlab file, or else the digest of the data as given, or as
+    loaded if it was loaded before the cache was enabled.
+    """
+    if fn in self.sources:
+      return self.sources[fn]
+    
+    filename, d_dict = self.pending.get(fn, (None, None))
+    if filename == None:
+      sid = digest(self.data[fn])
+    elif d_dict != None and 'digest' in d_dict:
+      sid = str(d_dict['digest'])
+    elif self.directory != None:
+      path = os.path.abspath(self.directory + filename)
+      st   = os.stat(path)
+      sid  = (path, st.st_size, st.st_mtime)
+    else:
+      sid  = digest(d_dict['map_data'])
+    
+    self.sources[fn] = sid
+    return sid
+
+  def mesh_digest(self, mesh):
+    """
+    Return the digest of the coordinates and cells of <mesh>, computed once
+    per mesh.
+    """
+    if mesh.id() not in DataInput.mesh_digests:
+      DataInput.mesh_digests[mesh.id()] = digest(mesh.coordinates(), 
+                                                 mesh.cells())
+    return DataInput.mesh_digests[mesh.id()]
 
   def get_nearest_expression(self, fn, bool_data=False):
     """
     Returns a dolfin expression using a nearest-neighbor interpolant of data 
-    <fn>.  If <bool_data> is True, convert to boolean.
+    <fn>.  If <bool_data> is True, convert to boolean.  The expression's 
+    eval_points(x, y) method evaluates arrays of coordinates at once.
     """
     print "::: getting %s nearest expression from %s :::" % (fn, self.name)
     
@@ -334,6 +655,9 @@ class DataInput(object):
 
     xs       = self.x
     ys       = self.y
+    dx       = self.grid_spacing(xs)
+    dy       = self.grid_spacing(ys)
+    nearest  = DataInput.nearest_index
     chg_proj = self.chg_proj
 
     class newExpression(Expression):
@@ -342,9 +666,14 @@ class DataInput(object):
           xn, yn = transform(new_proj, old_proj, x[0], x[1])
         else:
           xn, yn = x[0], x[1]
-        idx       = abs(self.xs - xn).argmin()
-        idy       = abs(self.ys - yn).argmin()
-        values[0] = self.data[idy, idx]
+        idx       = nearest(xs, dx, xn)
+        idy       = nearest(ys, dy, yn)
+        values[0] = data[idy, idx]
+      
+      def eval_points(self, x, y):
+        if chg_proj:
+          x, y = transform(new_proj, old_proj, x, y)
+        return data[nearest(ys, dy, y), nearest(xs, dx, x)]
 
     return newExpression(element = self.func_space.ufl_element())
 
@@ -353,6 +682,8 @@ class DataInput(object):
     Creates a spline-interpolation expression for data <fn>.  Optional 
     arguments <kx> and <ky> determine order of approximation in x and y
     directions (default cubic).  If <bool_data> is True, convert to boolean.
+    The expression's eval_points(x, y) method evaluates arrays of coordinates
+    at once.
     """
     print "::: getting %s spline expression from %s :::" % (fn, self.name)
 
@@ -373,48 +704,160 @@ class DataInput(object):
         else:
           xn, yn = x[0], x[1]
         values[0] = spline(xn, yn)
+      
+      def eval_points(self, x, y):
+        if chg_proj:
+          x, y = transform(new_proj, old_proj, x, y)
+        return spline.ev(x, y)
   
     return newExpression(element = self.func_space.ufl_element())
   
-  def get_nearest(self, fn):
+  def get_dof_coordinates(self, func_space=None):
     """
-    returns a dolfin Function object with values given by interpolated 
-    nearest-neighbor data <fn>.
+    Return arrays of the x and y coordinates of the degrees of freedom of 
+    FunctionSpace <func_space> (default this object's func_space) in this
+    DataInput's projection.
     """
-    #FIXME: get to work with a change of projection.
-    # get the dofmap to map from mesh vertex indices to function indicies :
-    df    = self.func_space.dofmap()
-    dfmap = df.vertex_to_dof_map(self.mesh)
+    if func_space == None:
+      func_space = self.func_space
     
-    unew  = Function(self.func_space)         # existing dataset projection
-    uocom = unew.vector().array()             # mesh indexed main vertex values
+    mesh = func_space.mesh()
+    elem = (str(func_space.ufl_element()), func_space.dim())
+    if self.chg_proj:
+      key = (mesh.id(), elem, self.p.srs, self.new_p.srs)
+    else:
+      key = (mesh.id(), elem, None, None)
+    
+    if key in DataInput.coord_cache:
+      return DataInput.coord_cache[key]
+    
+    gdim   = mesh.geometry().dim()
+    coords = func_space.dofmap().tabulate_all_coordinates(mesh)
+    coords = coords.reshape((-1, gdim))
+    x      = coords[:,0]
+    y      = coords[:,1]
     
-    d     = float64(self.data[fn])            # original matlab spec dataset
+    # transform all of the points with a single call :
+    if self.chg_proj:
+      print "::: transforming %i coordinates for %s :::" % (len(x), self.name)
+      x, y = transform(self.new_p, self.p, x, y)
+    
+    DataInput.coord_cache[key] = (array(x), array(y))
+    return DataInput.coord_cache[key]
+
+  def grid_spacing(self, xs):
+    """
+    Return the spacing of the grid axis <xs> if it is uniform, as it is for
+    every DataFactory grid, or None if it is not, e.g., after remove_nans 
+    has dropped rows or columns from the interior.
+    """
+    if len(xs) < 2:
+      return None
+    dx = (xs[-1] - xs[0]) / float(len(xs) - 1)
+    if dx == 0 or abs(diff(xs) - dx).max() > 1e-6 * abs(dx):
+      return None
+    return dx
+
+  @staticmethod
+  def nearest_index(xs, dx, xn):
+    """
+    Return the index of the point of grid axis <xs> closest to <xn>, which may
+    be an array or a scalar.  If the axis is uniform with spacing <dx> this is
+    closed-form, otherwise (<dx> = None) a binary search.  Ties go to the lower
+    index, as with argmin.
+    """
+    n = len(xs)
+    if dx != None:
+      idx = ceil((xn - xs[0]) / dx - 0.5)
+      return clip(idx, 0, n-1).astype(int)
+    idx = clip(searchsorted(xs, xn), 1, n-1)
+    lft = xs[idx-1]
+    rgt = xs[idx]
+    return where(xn - lft <= rgt - xn, idx-1, idx)
 
-    # get arrays of x-values for specific domain
-    xs    = self.x
-    ys    = self.y
+  def nearest_indices(self, x, y):
+    """
+    Return the indices into the x and y axes of this object's grid of the 
+    data points closest to the coordinates <x> and <y>.
+    """
+    idx = self.nearest_index(self.x, self.grid_spacing(self.x), x)
+    idy = self.nearest_index(self.y, self.grid_spacing(self.y), y)
+    return idx, idy
+
+  def get_spline_function(self, fn, func_space=None, kx=3, ky=3, 
+                          bool_data=False):
+    """
+    Returns a dolfin Function in FunctionSpace <func_space> (default this 
+    object's func_space) with values of data <fn> given by spline 
+    interpolation of order <kx> and <ky> evaluated at every degree of freedom 
+    in one call.  If <bool_data> is True, convert to boolean.
+    """
+    print "::: getting %s spline function from %s :::" % (fn, self.name)
+    
+    if func_space == None:
+      func_space = self.func_space
+
+    data = self.data[fn]
+    if bool_data: 
+      data = data.copy()
+      data[data > 0] = 1
+    
+    spline = RectBivariateSpline(self.x, self.y, data.T, kx=kx, ky=ky)
+    x, y   = self.get_dof_coordinates(func_space)
+    
+    f = Function(func_space)
+    f.vector().set_local(spline.ev(x, y))
+    f.vector().apply('insert')
+    return f
+
+  def get_nearest_function(self, fn, func_space=None, bool_data=False):
+    """
+    Returns a dolfin Function in FunctionSpace <func_space> (default this 
+    object's func_space) with values of data <fn> given by the nearest 
+    data point to every degree of freedom.  If <bool_data> is True, convert 
+    to boolean.
+    """
+    print "::: getting %s nearest function from %s :::" % (fn, self.name)
+    
+    if func_space == None:
+      func_space = self.func_space
+
+    data = self.data[fn]
+    if bool_data: 
+      data = data.copy()
+      data[data > 0] = 1
+    
+    x, y     = self.get_dof_coordinates(func_space)
+    idx, idy = self.nearest_indices(x, y)
+    
+    f = Function(func_space)
+    f.vector().set_local(float64(data[idy, idx]))
+    f.vector().apply('insert')
+    return f
+
+  def get_nearest(self, fn):
+    """
+    returns a dolfin Function object with values given by interpolated 
+    nearest-neighbor data <fn>, with all values above zero set to one.
+    """
+    def compute():
+      d        = float64(self.data[fn])         # original matlab spec dataset
+    
+      # indexes of closest datapoints to every dof of the function space :
+      x, y     = self.get_dof_coordinates()
+      idx, idy = self.nearest_indices(x, y)
     
-    for v in vertices(self.mesh):
-      # mesh vertex x,y coordinate :
-      i   = v.index()
-      p   = v.point()
-      x   = p.x()
-      y   = p.y()
-      
-      # indexes of closest datapoint to specific dataset's x and y domains :
-      idx = abs(xs - x).argmin()
-      idy = abs(ys - y).argmin()
-      
       # data value for closest value :
-      dv  = d[idy, idx] 
-      if dv > 0:
-        dv = 1.0
-      uocom[i] = dv
+      dv         = d[idy, idx]
+      dv[dv > 0] = 1.0
     
-    # set the values of the empty function's vertices to the data values :
-    unew.vector().set_local(uocom[dfmap])
-    return unew
+      # set the values of the empty function's dofs to the data values :
+      unew  = Function(self.func_space)
+      unew.vector().set_local(dv)
+      unew.vector().apply('insert')
+      return unew
+    return self.get_cached_function('nearest', fn, self.func_space, (), 
+                                    compute)
 
 
 class DataOutput(object):
@@ -440,7 +883,111 @@ class DataOutput(object):
     file_handle = File(self.directory + name + extension)
     file_handle << data
 
-  def write_matlab(self, di, f, outfile, val=-2e9):
+  def grid_evaluator(self, f, val):
+    """
+    Return a function evaluate(x, y) which returns the values of FEniCS 
+    Function <f> at the points of the grid with axes <x> and <y>, as an array 
+    of shape (y.size, x.size), set to <val> where the points are outside of 
+    the mesh.  
+    
+    All of the points are located at once with a trapezoid map of the 
+    cells, and <f> is evaluated in bulk in the cells containing them.  The 
+    basis functions of a Lagrange element are polynomials in the barycentric
+    coordinates of the cell which are the same for every cell, and are found
+    once from the dofs of the first cell.  <f> must be a scalar function in
+    a continuous or discontinuous Lagrange space on a triangle mesh in the
+    plane.
+    """
+    V    = f.function_space()
+    mesh = V.mesh()
+    elem = V.ufl_element()
+    tdim = mesh.topology().dim()
+    gdim = mesh.geometry().dim()
+    
+    if tdim != 2 or gdim != 2:
+      raise ValueError('cannot evaluate a function on a mesh of dimension ' \
+                       '%i in %i dimensions on a grid' % (tdim, gdim))
+    if elem.family() not in ('Lagrange', 'Discontinuous Lagrange') \
+       or f.value_rank() != 0:
+      raise ValueError('cannot evaluate a function in %s on a grid' % elem)
+    
+    coord  = mesh.coordinates()
+    cells  = array(mesh.cells(), dtype=int)
+    finder = Triangulation(coord[:,0], coord[:,1], cells).get_trifinder()
+    
+    # dofs of every cell, and the values of <f> at them :
+    dofmap = V.dofmap()
+    dofs   = array([dofmap.cell_dofs(c) for c in range(len(cells))], 
+                   dtype=int)
+    u      = f.vector().array()[dofs]
+    
+    def barycentric(t, X, Y):
+      v   = coord[cells[t]]
+      d1x = v[:,1,0] - v[:,0,0]
+      d1y = v[:,1,1] - v[:,0,1]
+      d2x = v[:,2,0] - v[:,0,0]
+      d2y = v[:,2,1] - v[:,0,1]
+      rx  = X - v[:,0,0]
+      ry  = Y - v[:,0,1]
+      det = d1x*d2y - d1y*d2x
+      return (rx*d2y - ry*d2x) / det, (d1x*ry - d1y*rx) / det
+    
+    # monomials of the barycentric coordinates up to the element degree :
+    k      = elem.degree()
+    powers = [(a, b) for a in range(k+1) for b in range(k+1-a)]
+    
+    def monomials(l1, l2):
+      return array([l1**a * l2**b for a, b in powers]).T
+    
+    # coefficients of the basis functions in the monomials, from the 
+    # barycentric coordinates of the dofs of the first cell :
+    dc     = dofmap.tabulate_all_coordinates(mesh).reshape((-1, gdim))
+    dc     = dc[dofs[0]]
+    l1, l2 = barycentric(zeros(len(dc), dtype=int), dc[:,0], dc[:,1])
+    C      = inv(monomials(l1, l2))
+
+    def evaluate(x, y):
+      X, Y       = meshgrid(x, y)
+      fa         = val * ones(X.shape)
+      t          = finder(X, Y)
+      inside     = t >= 0
+      t          = t[inside]
+      l1, l2     = barycentric(t, X[inside], Y[inside])
+      fa[inside] = (dot(monomials(l1, l2), C) * u[t]).sum(axis=1)
+      return fa
+    return evaluate
+
+  def resample(self, di, f, val=-2e9, procs=1):
+    """
+    Return the values of FEniCS Function <f> at the points of the regular 
+    grid of DataInput <di>, as an array of shape (di.y.size, di.x.size).
+    Values not in the mesh are set to <val>.  The rows of the grid are 
+    evaluated in blocks, which are split across <procs> processes if 
+    <procs> > 1.
+    """
+    print "::: resampling onto the %i x %i grid of %s :::" \
+          % (di.x.size, di.y.size, di.name)
+    
+    evaluate = self.grid_evaluator(f, val)
+    blocks   = array_split(arange(di.y.size), max(1, di.y.size / 64))
+    
+    if procs > 1:
+      resample_state['evaluate'] = evaluate
+      resample_state['x']        = di.x
+      resample_state['y']        = di.y
+      pool = Pool(procs)
+      try:
+        parts = pool.map(resample_rows, blocks)
+      finally:
+        pool.close()
+        pool.join()
+        resample_state.clear()
+    else:
+      parts = [evaluate(di.x, di.y[rows]) for rows in blocks]
+    
+    return vstack(parts)
+
+  def write_matlab(self, di, f, outfile, val=-2e9, procs=1):
     """ 
     Using the projections that are read in as data files, create Matlab
     version 4 files to output the regular gridded data in a field.
@@ -452,18 +999,12 @@ class DataOutput(object):
                 simulation.
       outfile : a file name for the matlab file output (include the
                 extension) values not in mesh are set to <val>, default -2e9. 
+      procs   : number of processes used to resample <f>, default 1.
     
     OUTPUT: 
       A single file will be written with name, outfile.
     """
-    fa = zeros( (di.y.size, di.x.size) )
-    parameters['allow_extrapolation'] = True
-    for j,x in enumerate(di.x):
-      for i,y in enumerate(di.y):
-        try:
-          fa[i,j] = f(x,y)
-        except: 
-          fa[i,j] = val
+    fa = self.resample(di, f, val, procs)
     
     savemat(outfile, {'map_data'          : fa,
                       'map_eastern_edge'  : di.x_max,
@@ -476,6 +1017,62 @@ class DataOutput(object):
                       'standard lon'      : di.lon_0,
                       'lat true scale'    : di.lat_ts})
 
+  def write_netcdf(self, di, f, outfile, name='map_data', val=-2e9, procs=1):
+    """
+    Resample FEniCS function <f> onto the regular grid of DataInput <di> as 
+    with write_matlab(), and write it to the NetCDF file <outfile> as 
+    variable <name> with coordinate variables x and y.  The projection of 
+    <di> is stored as a proj4 string in the 'proj4' attribute of the file.
+    """
+    fa = self.resample(di, f, val, procs)
+    
+    nc = netcdf_file(outfile, 'w')
+    nc.proj4 = di.p.srs
+    nc.createDimension('x', di.x.size)
+    nc.createDimension('y', di.y.size)
+    
+    x       = nc.createVariable('x', 'd', ('x',))
+    x[:]    = di.x
+    x.units = 'm'
+    y       = nc.createVariable('y', 'd', ('y',))
+    y[:]    = di.y
+    y.units = 'm'
+    
+    v            = nc.createVariable(name, 'd', ('y', 'x'))
+    v[:]         = fa
+    v._FillValue = val
+    nc.close()
+
+  def write_geotiff(self, di, f, outfile, val=-2e9, procs=1):
+    """
+    Resample FEniCS function <f> onto the regular grid of DataInput <di> as 
+    with write_matlab(), and write it to the GeoTIFF file <outfile>, 
+    georeferenced with the projection of <di>.  The grid of <di> must be 
+    uniform.
+    """
+    dx = di.grid_spacing(di.x)
+    dy = di.grid_spacing(di.y)
+    if dx == None or dy == None:
+      raise ValueError('the grid of %s is not uniform' % di.name)
+    
+    fa = self.resample(di, f, val, procs)
+    
+    srs = osr.SpatialReference()
+    srs.ImportFromProj4(di.p.srs)
+    
+    # GeoTIFF rows run from north to south, with the transform referring to
+    # the outer corner of the first pixel :
+    ds = gdal.GetDriverByName('GTiff').Create(outfile, di.x.size, di.y.size,
+                                              1, gdal.GDT_Float64)
+    ds.SetGeoTransform((di.x_min - dx/2.0, dx, 0.0,
+                        di.y_max + dy/2.0, 0.0, -dy))
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(val)
+    band.WriteArray(fa[::-1, :])
+    band.FlushCache()
+    ds = None
+
 
 class MeshGenerator(object):
   """